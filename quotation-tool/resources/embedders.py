@@ -0,0 +1,169 @@
+import logging
+import random
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
+import numpy as np
+from openai import OpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from tqdm import tqdm
+
+
+class Embedder(ABC):
+    """Turns texts into float32 embedding matrices; subclasses wrap one model backend"""
+    backend = None
+
+    def __init__(self, model: str):
+        self.model = model
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def name(self) -> str:
+        """Key under which this embedder's vectors are cached"""
+        return self.model
+
+    def describe(self) -> Dict[str, str]:
+        """Configuration recorded in index metadata; create_embedder() rebuilds the embedder from it"""
+        return {'backend': self.backend, 'model': self.model}
+
+    @abstractmethod
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed many texts, e.g. every row while indexing"""
+
+    def embed_query(self, texts: List[str]) -> np.ndarray:
+        """Embed a few query texts with the lowest latency"""
+        return self.embed(texts)
+
+
+class OpenAIEmbedder(Embedder):
+    """OpenAI embeddings API with token-budgeted, concurrent, retried bulk requests"""
+    backend = 'openai'
+
+    # OpenAI accepts at most 2048 inputs per embeddings request
+    MAX_INPUTS = 2048
+
+    def __init__(self,
+                 model: str = "text-embedding-3-small",
+                 api_key: str = None,
+                 batch_tokens: int = 250_000,
+                 concurrency: int = 4):
+        """
+        Args:
+            model: OpenAI embedding model
+            api_key: OpenAI API key
+            batch_tokens: Approximate token budget of one embeddings request
+            concurrency: Maximum embeddings requests in flight while indexing
+        """
+        super().__init__(model)
+        self.api_key = api_key
+        self._client = None
+        self.batch_tokens = batch_tokens
+        self.concurrency = concurrency
+
+    @property
+    def client(self) -> OpenAI:
+        # Created on first use so an index built with another backend needs no API key
+        if self._client is None:
+            self._client = OpenAI(api_key=self.api_key)
+        return self._client
+
+    def embed_query(self, texts: List[str]) -> np.ndarray:
+        return self._embed_batch(texts)
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        """Embed many texts with token-budgeted multi-input requests run concurrently"""
+        batches = self._batches(texts)
+        self.logger.info(f"Embedding {len(texts)} texts in {len(batches)} requests "
+                         f"({self.concurrency} concurrent)")
+
+        embeddings = None
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [(start, executor.submit(self._embed_batch, batch)) for start, batch in batches]
+            for start, future in tqdm(futures, desc="Embedding batches"):
+                batch_embeddings = future.result()
+                if embeddings is None:
+                    embeddings = np.empty((len(texts), batch_embeddings.shape[1]), dtype=np.float32)
+                embeddings[start:start + len(batch_embeddings)] = batch_embeddings
+
+        return embeddings if embeddings is not None else np.zeros((0, 0), dtype=np.float32)
+
+    def _batches(self, texts: List[str]) -> List[tuple]:
+        """Split texts into (start offset, texts) batches that fit the token budget"""
+        batches = []
+        start = 0
+        batch_tokens = 0
+        for i, text in enumerate(texts):
+            # ~3 characters per token is a conservative estimate for tabular text
+            tokens = len(text) // 3 + 1
+            if i > start and (batch_tokens + tokens > self.batch_tokens or i - start >= self.MAX_INPUTS):
+                batches.append((start, texts[start:i]))
+                start, batch_tokens = i, 0
+            batch_tokens += tokens
+        if start < len(texts):
+            batches.append((start, texts[start:]))
+        return batches
+
+    def _embed_batch(self, texts: List[str], max_retries: int = 6) -> np.ndarray:
+        """One multi-input embeddings request, retried with exponential backoff on rate limits"""
+        for attempt in range(max_retries + 1):
+            try:
+                response = self.client.embeddings.create(model=self.model, input=texts)
+                return np.array([item.embedding for item in sorted(response.data, key=lambda d: d.index)],
+                                dtype=np.float32)
+            except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as e:
+                if attempt == max_retries:
+                    self.logger.error(f"Error getting embeddings after {max_retries} retries: {e}")
+                    raise
+                delay = min(60.0, 2 ** attempt) + random.uniform(0, 1)
+                self.logger.warning(f"Embeddings request failed ({type(e).__name__}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Local SentenceTransformer model; runs offline on CPU"""
+    backend = 'sentence-transformers'
+
+    def __init__(self, model: str = 'all-MiniLM-L6-v2', batch_size: int = 256, device: str = None):
+        """
+        Args:
+            model: SentenceTransformer model name or path
+            batch_size: Texts per forward pass while indexing
+            device: Torch device, e.g. "cpu"; None lets SentenceTransformer choose
+        """
+        super().__init__(model)
+        self.batch_size = batch_size
+        self.device = device
+        self._model = None
+
+    @property
+    def encoder(self):
+        # Imported and loaded on first use so OpenAI-only deployments never load torch
+        if self._model is None:
+            from sentence_transformers import SentenceTransformer
+            self._model = SentenceTransformer(self.model, device=self.device)
+        return self._model
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return self.encoder.encode(
+            texts,
+            batch_size=self.batch_size,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=len(texts) > self.batch_size
+        ).astype(np.float32, copy=False)
+
+    def embed_query(self, texts: List[str]) -> np.ndarray:
+        return self.encoder.encode(texts, convert_to_numpy=True, normalize_embeddings=True).astype(np.float32, copy=False)
+
+
+EMBEDDERS = {embedder.backend: embedder for embedder in (OpenAIEmbedder, SentenceTransformerEmbedder)}
+
+
+def create_embedder(config: Dict[str, str], **kwargs) -> Embedder:
+    """Rebuild an embedder from its describe() output; kwargs go to the backend's constructor"""
+    if config['backend'] not in EMBEDDERS:
+        raise ValueError(f"Unknown embedding backend: {config['backend']}")
+    if config.get('model'):
+        kwargs['model'] = config['model']
+    return EMBEDDERS[config['backend']](**kwargs)
@@ -0,0 +1,162 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """Two-tier text-embedding cache: an in-process LRU in front of a SQLite store.
+
+    Entries are keyed by (model, whitespace-normalized text) and both tiers evict
+    least-recently-used entries once they exceed their byte budget.
+    """
+
+    def __init__(self,
+                 path: Union[str, Path] = "embedding_cache.sqlite3",
+                 memory_bytes: int = 64 * 1024 * 1024,
+                 disk_bytes: int = 1024 * 1024 * 1024):
+        """
+        Args:
+            path: SQLite file for the on-disk tier
+            memory_bytes: Budget for vectors held in the in-process LRU
+            disk_bytes: Budget for vectors held in the SQLite store
+        """
+        self.path = Path(path)
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._lock = threading.Lock()
+        self.hits = {'memory': 0, 'disk': 0}
+        self.misses = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(self.path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key BLOB PRIMARY KEY, model TEXT NOT NULL, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._db.commit()
+        self._disk_size = self._db.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def normalize(text: str) -> str:
+        """Collapse runs of whitespace so trivially different queries share an entry"""
+        return " ".join(text.split())
+
+    def _key(self, model: str, text: str) -> bytes:
+        return hashlib.blake2b(f"{model}\0{self.normalize(text)}".encode('utf-8'), digest_size=16).digest()
+
+    def get(self, model: str, text: str) -> Optional[np.ndarray]:
+        """Cached float32 embedding, or None"""
+        key = self._key(model, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits['memory'] += 1
+                return vector
+
+            row = self._db.execute("SELECT vector FROM embeddings WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE embeddings SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._db.commit()
+            self.hits['disk'] += 1
+            vector = np.frombuffer(row[0], dtype=np.float32)
+            self._remember(key, vector)
+            return vector
+
+    def put(self, model: str, text: str, vector: np.ndarray) -> None:
+        """Store an embedding in both tiers"""
+        key = self._key(model, text)
+        vector = np.array(vector, dtype=np.float32).ravel()
+        vector.flags.writeable = False
+        with self._lock:
+            self._remember(key, vector)
+            previous = self._db.execute("SELECT LENGTH(vector) FROM embeddings WHERE key = ?", (key,)).fetchone()
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)",
+                (key, model, vector.tobytes(), time.time())
+            )
+            self._disk_size += vector.nbytes - (previous[0] if previous else 0)
+            self._evict_disk()
+            self._db.commit()
+
+    def get_or_compute(self,
+                       model: str,
+                       texts: List[str],
+                       compute: Callable[[List[str]], np.ndarray],
+                       dim: int = None) -> np.ndarray:
+        """Embeddings for texts as one float32 matrix, calling compute once for the distinct misses.
+
+        Args:
+            dim: Embedding width, used for the (0, dim) result of an empty texts list; defaults
+                to the width of the model's cached vectors, or 0 when none are cached
+        """
+        if not texts:
+            return np.zeros((0, self._width(model) if dim is None else dim), dtype=np.float32)
+        cached = [self.get(model, text) for text in texts]
+        missing = list(dict.fromkeys(
+            self.normalize(text) for text, vector in zip(texts, cached) if vector is None
+        ))
+        if missing:
+            computed = dict(zip(missing, np.asarray(compute(missing), dtype=np.float32)))
+            for text, vector in computed.items():
+                self.put(model, text, vector)
+            cached = [computed[self.normalize(text)] if vector is None else vector
+                      for text, vector in zip(texts, cached)]
+        return np.array(cached, dtype=np.float32).reshape(len(texts), -1)
+
+    def _width(self, model: str) -> int:
+        with self._lock:
+            row = self._db.execute("SELECT LENGTH(vector) FROM embeddings WHERE model = ? LIMIT 1", (model,)).fetchone()
+        return row[0] // np.dtype(np.float32).itemsize if row else 0
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        if key in self._memory:
+            self._memory_size -= self._memory.pop(key).nbytes
+        self._memory[key] = vector
+        self._memory_size += vector.nbytes
+        while self._memory_size > self.memory_bytes and len(self._memory) > 1:
+            self._memory_size -= self._memory.popitem(last=False)[1].nbytes
+
+    def _evict_disk(self) -> None:
+        """Drop the least recently used rows until the store is back under 90% of its budget"""
+        if self._disk_size <= self.disk_bytes:
+            return
+        target = int(self.disk_bytes * 0.9)
+        rows = self._db.execute("SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used")
+        evicted = []
+        for key, size in rows:
+            if self._disk_size <= target:
+                break
+            evicted.append((key,))
+            self._disk_size -= size
+        self._db.executemany("DELETE FROM embeddings WHERE key = ?", evicted)
+        logging.info(f"Evicted {len(evicted)} cached embeddings from {self.path}")
+
+    def stats(self) -> Dict:
+        """Hit counters and tier sizes"""
+        lookups = self.hits['memory'] + self.hits['disk'] + self.misses
+        return {
+            'memory_hits': self.hits['memory'],
+            'disk_hits': self.hits['disk'],
+            'misses': self.misses,
+            'hit_rate': (self.hits['memory'] + self.hits['disk']) / lookups if lookups else 0.0,
+            'memory_entries': len(self._memory),
+            'memory_bytes': self._memory_size,
+            'disk_bytes': self._disk_size
+        }
+
+    def close(self) -> None:
+        self._db.close()
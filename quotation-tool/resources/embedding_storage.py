@@ -0,0 +1,125 @@
+import argparse
+import struct
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# float32 keeps the original pgvector column; the compact formats travel as packed bytes
+STORAGE_FORMATS = ('float32', 'float16', 'int8')
+# vector and halfvec values start with a varlena header plus int16 dim and unused fields
+PGVECTOR_HEADER = 8
+# halfvec_send() output starts with the int16 dim and unused fields
+HALFVEC_SEND_HEADER = struct.Struct('>hh')
+
+
+def encode(vector: np.ndarray, storage: str) -> Tuple[bytes, Optional[float]]:
+    """Pack one embedding as halfvec_send() output (big-endian float16 after a dim header), or as
+    int8 codes plus a per-vector scale"""
+    vector = np.asarray(vector, dtype=np.float32)
+    if storage == 'float16':
+        return HALFVEC_SEND_HEADER.pack(len(vector), 0) + vector.astype('>f2').tobytes(), None
+    if storage == 'int8':
+        # Symmetric scaling to the vector's own largest component keeps the full int8 range in use
+        scale = float(np.abs(vector).max()) / 127 or 1.0
+        return np.round(vector / scale).astype('i1').tobytes(), scale
+    raise ValueError(f"Unknown packed embedding storage: {storage}")
+
+
+def decode(packed: bytes, scale: Optional[float]) -> np.ndarray:
+    """float32 vector from encode() output; int8 vectors are the ones with a scale"""
+    if scale is None:
+        return np.frombuffer(packed, dtype='>f2', offset=HALFVEC_SEND_HEADER.size).astype(np.float32)
+    return np.frombuffer(packed, dtype='i1').astype(np.float32) * np.float32(scale)
+
+
+def halfvec_text(vector: np.ndarray) -> str:
+    """halfvec input text with the shortest repr of each float16, so uploads carry no float32 digits"""
+    return '[' + ','.join(str(value) for value in np.asarray(vector, dtype=np.float16)) + ']'
+
+
+def roundtrip(matrix: np.ndarray, storage: str) -> np.ndarray:
+    """The matrix as it reads back after being stored in the given format"""
+    if storage == 'float32':
+        return np.asarray(matrix, dtype=np.float32)
+    return np.stack([decode(*encode(vector, storage)) for vector in matrix])
+
+
+def stored_bytes(dim: int, storage: str) -> Tuple[int, int]:
+    """Bytes per row of the stored value and of the HNSW index element's vector.
+
+    Compact formats are both searched as halfvec, so int8 saves table space but not index space.
+    """
+    if storage == 'float32':
+        return PGVECTOR_HEADER + 4 * dim, PGVECTOR_HEADER + 4 * dim
+    if storage == 'float16':
+        return PGVECTOR_HEADER + 2 * dim, PGVECTOR_HEADER + 2 * dim
+    # bytea with a 4-byte varlena header, plus the real scale
+    return 4 + dim + 4, PGVECTOR_HEADER + 2 * dim
+
+
+def wire_bytes(vector: np.ndarray, storage: str) -> int:
+    """Size of one embedding in a PostgREST JSON response: vector text, or hex-encoded bytea"""
+    if storage == 'float32':
+        # pgvector prints the shortest repr that round-trips as float32, as str(np.float32) does
+        return len('[' + ','.join(str(value) for value in np.asarray(vector, dtype=np.float32)) + ']')
+    packed, scale = encode(vector, storage)
+    return 2 + 2 * len(packed) + (len(repr(scale)) if scale is not None else 0)
+
+
+def recall_at_k(matrix: np.ndarray, storage: str, k: int = 10, n_queries: int = 200, seed: int = 0) -> float:
+    """Share of the exact float32 cosine top-k that is still found against the stored vectors.
+
+    Rows of the matrix serve as queries; each query's own row is excluded from both rankings.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = np.asarray(matrix, dtype=np.float32)
+    queries = rng.choice(len(matrix), size=min(n_queries, len(matrix)), replace=False)
+
+    def top_k(candidates: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(candidates, axis=1)
+        scores = (matrix[queries] @ candidates.T) / np.where(norms == 0, 1, norms)
+        scores[np.arange(len(queries)), queries] = -np.inf
+        return np.argpartition(-scores, k, axis=1)[:, :k]
+
+    exact = top_k(matrix)
+    stored = top_k(roundtrip(matrix, storage))
+    return float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(exact, stored)]))
+
+
+def compare(matrix: np.ndarray, k: int = 10, n_queries: int = 200) -> Dict[str, Dict[str, float]]:
+    """Recall and per-row storage / index / transfer size of every storage format"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    sample = matrix[:min(len(matrix), 100)]
+    results = {}
+    for storage in STORAGE_FORMATS:
+        table_bytes, index_bytes = stored_bytes(matrix.shape[1], storage)
+        results[storage] = {
+            f'recall@{k}': round(recall_at_k(matrix, storage, k, n_queries), 4),
+            'stored_bytes': table_bytes,
+            'index_bytes': index_bytes,
+            'wire_bytes': int(np.mean([wire_bytes(vector, storage) for vector in sample]))
+        }
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare embedding storage formats')
+    parser.add_argument('--index', type=str, default=None,
+                        help='RAG index directory whose embeddings.npy to evaluate (default: synthetic data)')
+    parser.add_argument('--rows', type=int, default=20000, help='Rows of synthetic data')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.index:
+        from resources.rag_processor import RAGIndexStore
+        matrix = RAGIndexStore(args.index).load_embeddings(mmap=False)
+    else:
+        # Clustered unit vectors shaped like text-embedding-3-small output
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(200, 1536))
+        matrix = centers[rng.integers(0, len(centers), args.rows)] + rng.normal(scale=1.5, size=(args.rows, 1536))
+        matrix = (matrix / np.linalg.norm(matrix, axis=1, keepdims=True)).astype(np.float32)
+
+    for storage, stats in compare(matrix, args.k, args.queries).items():
+        print(f"{storage:>8}: " + ", ".join(f"{name}={value}" for name, value in stats.items()))
@@ -1,6 +1,6 @@
 import pandas as pd
-from rapidfuzz import fuzz, process
-from typing import List, Dict, Union
+from rapidfuzz import fuzz, process, utils
+from typing import List, Dict, Union, Optional, Tuple
 import logging
 import json
 from pathlib import Path
@@ -10,44 +10,68 @@ import faiss
 from sentence_transformers import SentenceTransformer
 import numpy as np
 from tqdm import tqdm
+import time
+import hashlib
+from collections import Counter
+from dataclasses import dataclass
+from resources.embedding_cache import EmbeddingCache
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 class DataLoader:
     """Handles loading and preprocessing of Excel/CSV data"""
-    def __init__(self, file_path: str):
+    def __init__(self, file_path: str, cache_dir: str = "parsed_cache", header_confidence: float = 0.15):
+        """
+        Args:
+            file_path: Excel/CSV price list
+            cache_dir: Directory for the parsed-data cache
+            header_confidence: Minimum score margin between the best and second-best
+                header candidate for the local detector's answer to be used without the LLM
+        """
         self.file_path = Path(file_path)
+        self.cache_dir = Path(cache_dir)
+        self.header_confidence = header_confidence
         self.df = None
         self.llm_client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        self._file_hash = None
 
     def load(self) -> pd.DataFrame:
         """Load and preprocess the data file"""
         try:
+            if self.file_path.suffix.lower() not in ['.csv', '.xlsx', '.xls']:
+                raise ValueError(f"Unsupported file format: {self.file_path.suffix}")
+
+            # An unchanged file skips parsing entirely
+            self.df = self._load_cached_frame()
+            if self.df is not None:
+                logging.info(f"Loaded parsed data from cache with {len(self.df)} rows")
+                logging.info(f"Columns: {list(self.df.columns)}")
+                return self.df
+
             if self.file_path.suffix.lower() == '.csv':
                 self.df = pd.read_csv(self.file_path)
-            elif self.file_path.suffix.lower() in ['.xlsx', '.xls']:
-                # Try to load saved header info first
-                header_row_idx = self._load_header_info()
-
-                if header_row_idx is None:
-                    # If no saved header info, detect it and save
-                    df_temp = pd.read_excel(self.file_path)
-                    header_row_idx = self._detect_header_row(df_temp)
-                    self._save_header_info(header_row_idx)
-                    self.df = pd.read_excel(self.file_path, skiprows=header_row_idx+1)
-                    self.df.columns = df_temp.iloc[header_row_idx]
-                else:
-                    print(f"Using saved header information (row {header_row_idx})")
-                    self.df = pd.read_excel(self.file_path, skiprows=header_row_idx+1)
-                    df_temp = pd.read_excel(self.file_path)
-                    self.df.columns = df_temp.iloc[header_row_idx]
             else:
-                raise ValueError(f"Unsupported file format: {self.file_path.suffix}")
+                # Parse the workbook once; every later view is sliced from this frame
+                raw = pd.read_excel(self.file_path, header=None)
+
+                # Try a known layout first; header rows are sheet row indexes into raw
+                header_row = self._load_header_info(raw)
+
+                if header_row is None:
+                    # If the layout is new, detect the header and remember the layout
+                    header_row, method, confidence = self._detect_header_row(raw)
+                    self._save_header_info(raw, header_row, method, confidence)
+                else:
+                    print(f"Using saved header layout (row {header_row})")
+
+                self.df = raw.iloc[header_row + 1:].reset_index(drop=True).infer_objects()
+                self.df.columns = raw.iloc[header_row]
 
             # Clean column names and convert to string
             self.df.columns = [str(col).strip().lower().replace(' ', '_') for col in self.df.columns]
             self.df = self.df.astype(str)
+            self._save_cached_frame()
 
             logging.info(f"Successfully loaded data with {len(self.df)} rows")
             logging.info(f"Columns: {list(self.df.columns)}")
@@ -58,40 +82,43 @@ class DataLoader:
             logging.error(f"Error loading data: {str(e)}")
             raise
 
-    def _save_header_info(self, header_row_idx: int) -> None:
-        """Save header information to JSON file"""
+    @staticmethod
+    def _layout_signature(row: pd.Series) -> str:
+        """Hash of a header row's labels and the sheet width; identical supplier templates share it"""
+        labels = [str(value).strip().lower() if pd.notna(value) else '' for value in row]
+        return hashlib.md5(json.dumps(labels).encode('utf-8')).hexdigest()
+
+    def _save_header_info(self, raw: pd.DataFrame, header_row: int, method: str, confidence: float) -> None:
+        """Save the detected header layout to a JSON file keyed by its signature"""
         header_dir = Path("header_info")
         header_dir.mkdir(exist_ok=True)
 
         header_info = {
-            'header_row_index': header_row_idx,
-            'file_hash': self._get_file_hash()
+            'columns': [str(value) if pd.notna(value) else None for value in raw.iloc[header_row]],
+            'detected_by': method,
+            'confidence': round(confidence, 3),
+            'source_file': self.file_path.name
         }
 
-        header_path = header_dir / f"{self.file_path.stem}_header.json"
+        header_path = header_dir / f"{self._layout_signature(raw.iloc[header_row])}.json"
         with open(header_path, 'w') as f:
             json.dump(header_info, f)
         print(f"Saved header information to {header_path}")
 
-    def _load_header_info(self) -> Union[int, None]:
-        """Load saved header information if it exists and matches file hash"""
+    def _load_header_info(self, raw: pd.DataFrame, max_rows: int = 50) -> Union[int, None]:
+        """Return the first sheet row whose layout signature was seen before, if any"""
         try:
             header_dir = Path("header_info")
-            header_path = header_dir / f"{self.file_path.stem}_header.json"
-
-            if not header_path.exists():
+            if not header_dir.exists():
                 return None
 
-            with open(header_path, 'r') as f:
-                header_info = json.load(f)
-
-            # Verify file hasn't changed using hash
-            if header_info.get('file_hash') == self._get_file_hash():
-                print("Found saved header information")
-                return header_info.get('header_row_index')
-            else:
-                print("File has changed, detecting headers again")
-                return None
+            for row_idx in range(min(max_rows, len(raw))):
+                if raw.iloc[row_idx].notna().sum() < 2:
+                    continue
+                if (header_dir / f"{self._layout_signature(raw.iloc[row_idx])}.json").exists():
+                    print("Found saved header information")
+                    return row_idx
+            return None
 
         except Exception as e:
             logging.error(f"Error loading header info: {str(e)}")
@@ -99,15 +126,122 @@ class DataLoader:
 
     def _get_file_hash(self) -> str:
         """Get hash of file for change detection"""
-        import hashlib
+        if self._file_hash is None:
+            hash_md5 = hashlib.md5()
+            with open(self.file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    hash_md5.update(chunk)
+            self._file_hash = hash_md5.hexdigest()
+        return self._file_hash
+
+    def _save_cached_frame(self) -> None:
+        """Write the cleaned DataFrame to a columnar cache keyed by the file hash"""
+        try:
+            self.cache_dir.mkdir(exist_ok=True)
+            cache_path = self.cache_dir / self._get_file_hash()
+            try:
+                self.df.to_parquet(cache_path.with_suffix('.parquet'), index=False)
+            except (ImportError, ValueError) as e:
+                # No Parquet engine installed, or column names Parquet rejects (e.g. duplicates)
+                logging.info(f"Falling back to .npz parsed-data cache: {str(e)}")
+                np.savez(
+                    cache_path.with_suffix('.npz'),
+                    columns=np.array(self.df.columns, dtype=str),
+                    **{f"col_{i}": self.df.iloc[:, i].to_numpy(dtype=str) for i in range(self.df.shape[1])}
+                )
+        except Exception as e:
+            logging.warning(f"Could not cache parsed data: {str(e)}")
+
+    def _load_cached_frame(self) -> Union[pd.DataFrame, None]:
+        """Load the cleaned DataFrame cached for this exact file, if any"""
+        try:
+            cache_path = self.cache_dir / self._get_file_hash()
+            if cache_path.with_suffix('.parquet').exists():
+                return pd.read_parquet(cache_path.with_suffix('.parquet'))
+            if cache_path.with_suffix('.npz').exists():
+                with np.load(cache_path.with_suffix('.npz'), allow_pickle=False) as cached:
+                    columns = cached['columns'].tolist()
+                    df = pd.DataFrame({i: cached[f"col_{i}"].astype(object) for i in range(len(columns))})
+                df.columns = columns
+                return df
+        except Exception as e:
+            logging.warning(f"Could not read parsed-data cache: {str(e)}")
+        return None
+
+    def _detect_header_row(self, raw: pd.DataFrame) -> tuple:
+        """Detect the header row locally, consulting the LLM only when the result is ambiguous.
+
+        Returns (sheet row index, method, confidence).
+        """
+        scores = self._score_header_rows(raw)
+        if len(scores) == 0:
+            return 0, 'default', 0.0
+
+        ranked = np.argsort(-scores, kind='stable')
+        best = int(ranked[0])
+        confidence = float(scores[best] - (scores[ranked[1]] if len(ranked) > 1 else 0.0))
+        if confidence >= self.header_confidence:
+            print(f"Detected header row {best} locally (confidence {confidence:.2f})")
+            return best, 'heuristic', confidence
+
+        print(f"Header detection ambiguous (confidence {confidence:.2f}), asking LLM")
+        # The LLM sees what pd.read_excel(file) returns, i.e. sheet row 0 as header
+        df_temp = raw.iloc[1:].reset_index(drop=True)
+        df_temp.columns = [col if pd.notna(col) else f"Unnamed: {i}" for i, col in enumerate(raw.iloc[0])]
+        return self._llm_header_row(df_temp) + 1, 'llm', confidence
+
+    @staticmethod
+    def _score_header_rows(raw: pd.DataFrame, max_rows: int = 50, window: int = 10) -> np.ndarray:
+        """Score each of the first rows on how much it looks like a header row"""
+        sample = raw.head(max_rows + window)
+        present = sample.notna().to_numpy()
+        is_text = sample.apply(lambda column: column.map(DataLoader._is_text)).to_numpy(dtype=bool)
+        fill = present.sum(axis=1)
+        max_fill = max(int(fill.max()), 1) if len(fill) else 1
+
+        scores = np.zeros(min(max_rows, len(sample)))
+        for row_idx in range(len(scores)):
+            n_present = fill[row_idx]
+            if n_present < 2:
+                continue
+            row_present = present[row_idx]
+            values = [str(value).strip().lower() for value in sample.iloc[row_idx][row_present]]
+
+            # Headers are labels: mostly text, spanning the table, with distinct values
+            string_density = is_text[row_idx][row_present].mean()
+            width = n_present / max_fill
+            uniqueness = len(set(values)) / n_present
+
+            # Cells below a header change type (text label over numbers) or are filled in
+            below_present = present[row_idx + 1:row_idx + 1 + window][:, row_present]
+            below_text = is_text[row_idx + 1:row_idx + 1 + window][:, row_present]
+            if len(below_present):
+                header_text = is_text[row_idx][row_present]
+                type_change = ((below_present & (below_text != header_text)).sum(axis=0)
+                               / np.maximum(below_present.sum(axis=0), 1)).mean()
+            else:
+                type_change = 0.0
+
+            # Title and note rows above a header are narrower than it
+            above_fill = fill[max(0, row_idx - 5):row_idx]
+            above_sparse = (above_fill < n_present).mean() if len(above_fill) else 1.0
+
+            scores[row_idx] = (0.3 * string_density + 0.2 * width + 0.1 * uniqueness
+                               + 0.2 * type_change + 0.2 * above_sparse)
+        return scores
 
-        hash_md5 = hashlib.md5()
-        with open(self.file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-        return hash_md5.hexdigest()
+    @staticmethod
+    def _is_text(value) -> bool:
+        """Whether a cell holds a non-numeric string"""
+        if not isinstance(value, str) or not value.strip():
+            return False
+        try:
+            float(value.replace(',', ''))
+            return False
+        except ValueError:
+            return True
 
-    def _detect_header_row(self, df: pd.DataFrame) -> int:
+    def _llm_header_row(self, df: pd.DataFrame) -> int:
         """Use LLM to detect header row"""
         try:
             sample_df = df.head(50)
@@ -139,20 +273,114 @@ class DataLoader:
 
 class VectorIndexer:
     """Handles vector indexing of data using FAISS"""
-    def __init__(self, embedding_model_name: str = 'all-MiniLM-L6-v2'):
+    # FAISS ids are 63-bit hashes of each row's combined text, so unchanged rows keep their vectors
+    ID_SCHEME = 'row_text_blake2b64'
+
+    def __init__(self,
+                 embedding_model_name: str = 'all-MiniLM-L6-v2',
+                 index_factory: str = 'Flat',
+                 search_params: Dict = None,
+                 batch_size: int = 256,
+                 chunk_size: int = 16384):
+        """
+        Args:
+            embedding_model_name: SentenceTransformer model used for row embeddings
+            index_factory: FAISS index-factory string, e.g. "Flat", "HNSW32",
+                "IVF1024,Flat" or "IVF1024,PQ32". Embeddings are L2-normalized at
+                encode time and searched by inner product (cosine similarity).
+            search_params: Query-time FAISS parameters such as {"nprobe": 16} or {"efSearch": 64}
+            batch_size: Rows per forward pass of the embedding model
+            chunk_size: Rows encoded per call before results are copied into the embedding matrix
+        """
+        self.embedding_model_name = embedding_model_name
         self.embedding_model = SentenceTransformer(embedding_model_name)
+        self.index_factory = index_factory
+        self.search_params = search_params or {}
+        self.batch_size = batch_size
+        self.chunk_size = chunk_size
         self.index = None
         self.embeddings = None
+        self.ids = None
+        self.row_ids = None
+        self.recall_report = None
+        self._texts = None
+        self._texts_df = None
 
     def create_index(self, df: pd.DataFrame) -> None:
         """Create FAISS index from DataFrame"""
         print("\nStarting indexing process...")
+        start = time.perf_counter()
 
-        text_columns = self._get_text_columns(df)
-        texts = self._combine_texts(df, text_columns)
-        self.embeddings = self._create_embeddings(texts)
+        texts = self._prepare_texts(df)
+        # Identical rows share one vector
+        self.ids, first_rows = np.unique(self.row_ids, return_index=True)
+        self.embeddings = self._create_embeddings([texts[i] for i in first_rows])
         self._build_faiss_index()
 
+        elapsed = time.perf_counter() - start
+        print(f"Indexed {len(df)} rows in {elapsed:.1f}s ({len(df) / max(elapsed, 1e-9):.0f} rows/s)")
+
+    def needs_update(self, df: pd.DataFrame, ids: np.ndarray) -> bool:
+        """Whether the DataFrame rows differ from the ids held by a saved index"""
+        self._prepare_texts(df)
+        return not np.array_equal(np.unique(self.row_ids), np.sort(ids))
+
+    def update_index(self,
+                     df: pd.DataFrame,
+                     index: faiss.Index,
+                     embeddings: Union[np.ndarray, None],
+                     ids: np.ndarray) -> bool:
+        """Re-encode only new or changed rows and update a saved index in place.
+
+        `embeddings` may be None for indexes that hold their own vectors; they are
+        then read back from the index. Returns True when the index changed and
+        needs to be saved again.
+        """
+        texts = self._prepare_texts(df)
+        if embeddings is None:
+            embeddings, ids = IndexManager.stored_vectors(index)
+        self.index, self.embeddings, self.ids = index, embeddings, ids
+
+        current_ids, first_rows = np.unique(self.row_ids, return_index=True)
+        kept = np.isin(ids, current_ids)
+        added = ~np.isin(current_ids, ids)
+        if kept.all() and not added.any():
+            print("Index is up to date with the data file")
+            return False
+
+        removed_ids = ids[~kept]
+        added_ids = current_ids[added]
+        print(f"Updating index: {len(added_ids)} new or changed rows, {len(removed_ids)} removed rows")
+
+        added_embeddings = self._create_embeddings([texts[i] for i in first_rows[added]])
+        self.embeddings = np.concatenate([embeddings[kept], added_embeddings])
+        self.ids = np.concatenate([ids[kept], added_ids])
+
+        try:
+            if len(removed_ids):
+                self.index.remove_ids(removed_ids)
+            if len(added_ids):
+                self.index.add_with_ids(added_embeddings, added_ids)
+        except RuntimeError as e:
+            # e.g. HNSW cannot delete vectors; rebuilding from cached embeddings still skips re-encoding
+            print(f"Index does not support in-place updates ({e}). Rebuilding from cached embeddings...")
+            self._build_faiss_index()
+        return True
+
+    def _prepare_texts(self, df: pd.DataFrame) -> List[str]:
+        """Combine row texts and compute their content ids, once per DataFrame"""
+        if self._texts_df is not df:
+            self._texts = self._combine_texts(df, self._get_text_columns(df))
+            self.row_ids = self.content_ids(self._texts)
+            self._texts_df = df
+        return self._texts
+
+    @staticmethod
+    def content_ids(texts: List[str]) -> np.ndarray:
+        """Non-negative int64 hash of each text, used as its FAISS id"""
+        digests = b''.join(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest() for text in texts)
+        return np.frombuffer(digests, dtype='<i8') & np.int64(0x7FFFFFFFFFFFFFFF)
+
     def _get_text_columns(self, df: pd.DataFrame) -> List[str]:
         """Identify text columns for indexing"""
         text_columns = []
@@ -163,63 +391,371 @@ class VectorIndexer:
         return text_columns
 
     def _combine_texts(self, df: pd.DataFrame, text_columns: List[str]) -> List[str]:
-        """Combine text columns into single strings"""
-        texts = []
-        for _, row in tqdm(df.iterrows(), total=len(df), desc="Combining text"):
-            text = " ".join(str(row[col]) for col in text_columns if pd.notna(row[col]))
-            texts.append(text)
-        return texts
+        """Combine text columns into single strings, one column at a time"""
+        texts = pd.Series('', index=df.index, dtype=object)
+        for col in text_columns:
+            values = df[col]
+            present = values.notna()
+            separator = np.where(texts.str.len() > 0, ' ', '')
+            texts = texts.where(~present, texts + separator + values.astype(str))
+        return texts.tolist()
 
     def _create_embeddings(self, texts: List[str]) -> np.ndarray:
-        """Create embeddings for texts"""
+        """Create normalized float32 embeddings, written chunk by chunk into one preallocated matrix"""
         print("\nGenerating embeddings...")
-        batch_size = 32
-        embeddings = []
-
-        for i in tqdm(range(0, len(texts), batch_size), desc="Creating embeddings"):
-            batch = texts[i:i + batch_size]
-            batch_embeddings = self.embedding_model.encode(batch)
-            embeddings.extend(batch_embeddings)
+        dimension = self.embedding_model.get_sentence_embedding_dimension()
+        embeddings = np.empty((len(texts), dimension), dtype='float32')
+
+        for i in tqdm(range(0, len(texts), self.chunk_size), desc="Creating embeddings"):
+            embeddings[i:i + self.chunk_size] = self.embedding_model.encode(
+                texts[i:i + self.chunk_size],
+                batch_size=self.batch_size,
+                convert_to_numpy=True,
+                normalize_embeddings=True,
+                show_progress_bar=False
+            )
 
-        return np.array(embeddings).astype('float32')
+        return embeddings
 
     def _build_faiss_index(self) -> None:
         """Build FAISS index from embeddings"""
-        print("\nCreating FAISS index...")
+        print(f"\nCreating FAISS index ({self.index_factory})...")
         dimension = self.embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
-        self.index.add(self.embeddings)
+
+        base_index = faiss.index_factory(dimension, self.index_factory, faiss.METRIC_INNER_PRODUCT)
+        if not base_index.is_trained:
+            base_index.train(self.embeddings)
+        if self._is_ivf(base_index):
+            # IVF stores ids in its inverted lists and removes them correctly without a wrapper
+            self.index = base_index
+        else:
+            self.index = faiss.IndexIDMap2(base_index)
+        self.index.add_with_ids(self.embeddings, self.ids)
+        self.apply_search_params(self.index, self.search_params)
         print(f"Indexing complete! {len(self.embeddings)} rows indexed with dimension {dimension}")
 
+        if self.index_factory != 'Flat':
+            self.recall_report = self.evaluate_recall()
+
+    @staticmethod
+    def _is_ivf(index: faiss.Index) -> bool:
+        """Whether the index is (or wraps) an IVF index"""
+        try:
+            faiss.extract_index_ivf(index)
+            return True
+        except RuntimeError:
+            return False
+
+    @staticmethod
+    def apply_search_params(index: faiss.Index, search_params: Dict) -> None:
+        """Set query-time parameters (nprobe, efSearch, ...) on an index"""
+        parameter_space = faiss.ParameterSpace()
+        for name, value in (search_params or {}).items():
+            parameter_space.set_index_parameter(index, name, value)
+
+    def evaluate_recall(self, k: int = 10, n_queries: int = 1000) -> Dict:
+        """Measure recall@k and query latency of the index against exact search"""
+        n_queries = min(n_queries, len(self.embeddings))
+        k = min(k, len(self.embeddings))
+        rng = np.random.default_rng(0)
+        queries = self.embeddings[rng.choice(len(self.embeddings), n_queries, replace=False)]
+
+        exact_index = faiss.IndexFlatIP(self.embeddings.shape[1])
+        exact_index.add(self.embeddings)
+
+        start = time.perf_counter()
+        _, exact_positions = exact_index.search(queries, k)
+        exact_ms = (time.perf_counter() - start) * 1000 / n_queries
+        exact_ids = self.ids[exact_positions]
+
+        start = time.perf_counter()
+        _, approx_ids = self.index.search(queries, k)
+        approx_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+        hits = sum(len(np.intersect1d(exact_row, approx_row)) for exact_row, approx_row in zip(exact_ids, approx_ids))
+        report = {
+            'index_factory': self.index_factory,
+            'search_params': self.search_params,
+            'k': k,
+            'n_queries': n_queries,
+            f'recall@{k}': round(hits / (n_queries * k), 4),
+            'exact_ms_per_query': round(exact_ms, 4),
+            'index_ms_per_query': round(approx_ms, 4)
+        }
+        print(f"Recall report: {json.dumps(report)}")
+        return report
+
 class IndexManager:
     """Manages saving and loading of indices"""
     @staticmethod
-    def save_index(index: faiss.Index, embeddings: np.ndarray, file_stem: str) -> None:
-        """Save FAISS index and embeddings"""
+    def save_index(index: faiss.Index,
+                   embeddings: np.ndarray,
+                   file_stem: str,
+                   index_config: Dict = None,
+                   ids: np.ndarray = None) -> None:
+        """Save FAISS index, the id-keyed embedding cache and the index configuration"""
         index_dir = Path("index_data")
         index_dir.mkdir(exist_ok=True)
 
         index_path = index_dir / f"{file_stem}_index.faiss"
         embeddings_path = index_dir / f"{file_stem}_embeddings.npy"
+        ids_path = index_dir / f"{file_stem}_ids.npy"
+        config_path = index_dir / f"{file_stem}_index.json"
+
+        # Write to a temp file and rename, so processes that memory-map the old files keep a valid mapping
+        IndexManager._replace_file(index_path, lambda path: faiss.write_index(index, str(path)))
+
+        if IndexManager.stores_vectors(index):
+            # The index already holds exact vectors and their ids; a second copy would only cost disk and RAM
+            embeddings_path.unlink(missing_ok=True)
+            ids_path.unlink(missing_ok=True)
+            print(f"Index saved to {index_path} (embeddings served from the index)")
+        else:
+            IndexManager._replace_file(embeddings_path, lambda path: IndexManager._save_array(path, embeddings))
+            if ids is not None:
+                IndexManager._replace_file(ids_path, lambda path: IndexManager._save_array(path, ids))
+            print(f"Index saved to {index_path}")
+            print(f"Embeddings saved to {embeddings_path}")
 
-        faiss.write_index(index, str(index_path))
-        np.save(embeddings_path, embeddings)
+        with open(config_path, 'w') as f:
+            json.dump(index_config or {}, f, indent=2)
 
-        print(f"Index saved to {index_path}")
-        print(f"Embeddings saved to {embeddings_path}")
+    @staticmethod
+    def _replace_file(path: Path, write) -> None:
+        """Atomically replace path with the output of write(tmp_path)"""
+        tmp_path = path.with_name(path.name + '.tmp')
+        write(tmp_path)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _save_array(path: Path, array: np.ndarray) -> None:
+        """np.save without the automatic .npy suffix"""
+        with open(path, 'wb') as f:
+            np.save(f, array)
+
+    @staticmethod
+    def stores_vectors(index: faiss.Index) -> bool:
+        """Whether the index keeps exact copies of its vectors alongside their ids (IDMap over Flat/HNSW-Flat)"""
+        if not isinstance(index, faiss.IndexIDMap2):
+            return False
+        base_index = faiss.downcast_index(index.index)
+        if isinstance(base_index, faiss.IndexHNSW):
+            base_index = faiss.downcast_index(base_index.storage)
+        return isinstance(base_index, faiss.IndexFlat)
+
+    @staticmethod
+    def stored_vectors(index: faiss.Index) -> tuple:
+        """Vectors and ids held by an index for which stores_vectors() is True, in storage order"""
+        base_index = faiss.downcast_index(index.index)
+        return base_index.reconstruct_n(0, base_index.ntotal), faiss.vector_to_array(index.id_map)
 
     @staticmethod
-    def load_index(file_stem: str) -> tuple:
-        """Load saved index and embeddings"""
+    def load_index_config(file_stem: str) -> Union[Dict, None]:
+        """Load the configuration saved alongside an index, None for legacy indexes"""
+        config_path = Path("index_data") / f"{file_stem}_index.json"
+        if not config_path.exists():
+            return None
+        with open(config_path, 'r') as f:
+            return json.load(f)
+
+    @staticmethod
+    def load_index(file_stem: str, mmap: bool = True) -> tuple:
+        """Load saved index, embeddings and their content ids.
+
+        With mmap=True the index and embeddings are memory-mapped read-only, so loading
+        is near-instant and processes on the same host share the page cache. Embeddings
+        are None when the index holds the vectors itself.
+        """
         index_dir = Path("index_data")
         index_path = index_dir / f"{file_stem}_index.faiss"
         embeddings_path = index_dir / f"{file_stem}_embeddings.npy"
+        ids_path = index_dir / f"{file_stem}_ids.npy"
 
-        if index_path.exists() and embeddings_path.exists():
+        if not index_path.exists():
+            return None, None, None
+
+        if mmap:
+            # IO_FLAG_MMAP_IFC (newer FAISS) maps flat, HNSW and IVF codes; IO_FLAG_MMAP only covers IVF lists
+            io_flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+            index = faiss.read_index(str(index_path), io_flags)
+        else:
             index = faiss.read_index(str(index_path))
-            embeddings = np.load(embeddings_path)
-            return index, embeddings
-        return None, None
+
+        if embeddings_path.exists():
+            embeddings = np.load(embeddings_path, mmap_mode='r' if mmap else None)
+            ids = np.load(ids_path) if ids_path.exists() else None
+            return index, embeddings, ids
+        if IndexManager.stores_vectors(index):
+            return index, None, faiss.vector_to_array(index.id_map)
+        return None, None, None
+
+class NGramIndex:
+    """Character-trigram/token inverted index used to prefilter fuzzy candidates"""
+    def __init__(self,
+                 values: np.ndarray,
+                 ngram_size: int = 3,
+                 max_candidates: int = 500,
+                 max_postings: int = 20000):
+        """
+        Args:
+            max_candidates: Values returned per query
+            max_postings: Postings read per query, taken from the rarest grams first, so query
+                cost stays flat as the catalog grows. A query whose grams do not all fit gets no
+                candidate list and is scored against every value.
+        """
+        self.ngram_size = ngram_size
+        self.max_candidates = max_candidates
+        self.max_postings = max_postings
+        self.size = len(values)
+
+        self.gram_ids = {}
+        gram_column = []
+        value_column = []
+        for value_id, value in enumerate(tqdm(values, desc="Building n-gram index", disable=len(values) < 100000)):
+            for gram in self._grams(value):
+                gram_column.append(self.gram_ids.setdefault(gram, len(self.gram_ids)))
+                value_column.append(value_id)
+
+        # Postings of gram g are postings[indptr[g]:indptr[g + 1]], in ascending value order
+        gram_column = np.asarray(gram_column, dtype=np.int64)
+        value_column = np.asarray(value_column, dtype=np.int64)
+        order = np.argsort(gram_column, kind='stable')
+        self.postings = value_column[order]
+        self.indptr = np.zeros(len(self.gram_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(gram_column, minlength=len(self.gram_ids)), out=self.indptr[1:])
+
+        logging.info(f"Built n-gram index with {len(self.gram_ids)} grams and {len(self.postings)} postings")
+
+    def _grams(self, value) -> set:
+        """Whole tokens plus padded character n-grams of each token"""
+        grams = set()
+        for token in utils.default_process(str(value)).split():
+            grams.add(f"#{token}")
+            padded = f" {token} "
+            for i in range(max(1, len(padded) - self.ngram_size + 1)):
+                grams.add(padded[i:i + self.ngram_size])
+        return grams
+
+    def candidates(self, query: str, ranges: List[Tuple[int, int]] = None) -> Optional[np.ndarray]:
+        """Sorted ids of the values sharing the most n-grams with the query.
+
+        Args:
+            ranges: [start, end) value-id ranges to search; all values by default
+
+        Returns:
+            None when the query's postings exceed max_postings. Dropping grams could lose the
+            best match, so the caller scores every value instead.
+        """
+        gram_ids = [self.gram_ids[gram] for gram in self._grams(query) if gram in self.gram_ids]
+        if not gram_ids:
+            return np.zeros(0, dtype=np.int64)
+
+        # Each gram's postings are sorted, so a value-id range is one contiguous slice of them
+        slices = []
+        for gram in gram_ids:
+            postings = self.postings[self.indptr[gram]:self.indptr[gram + 1]]
+            if ranges is None:
+                slices.append(postings)
+                continue
+            for start, end in ranges:
+                lo, hi = np.searchsorted(postings, [start, end])
+                slices.append(postings[lo:hi])
+
+        if sum(len(postings) for postings in slices) > self.max_postings:
+            return None
+
+        value_ids, shared = np.unique(np.concatenate(slices), return_counts=True)
+        if len(value_ids) > self.max_candidates:
+            top = np.argpartition(-shared, self.max_candidates - 1)[:self.max_candidates]
+            value_ids = np.sort(value_ids[top])
+        return value_ids
+
+
+class FuzzyIndex:
+    """Precomputed unique values and value->row lookups for matrix fuzzy scoring"""
+    def __init__(self, df: pd.DataFrame, candidate_index: bool = False, max_candidates: int = 500):
+        self.df = df
+        self.columns = df.columns.tolist()
+
+        values = []
+        row_groups = []
+        self.column_ranges = {}
+
+        for column in self.columns:
+            # factorize keeps first-appearance order, same as Series.unique()
+            codes, uniques = pd.factorize(df[column])
+            valid = codes >= 0
+            rows = np.flatnonzero(valid)
+            order = np.argsort(codes[valid], kind='stable')
+            counts = np.bincount(codes[valid], minlength=len(uniques))
+
+            start = len(values)
+            values.extend(uniques.tolist())
+            row_groups.append((rows[order], counts))
+            self.column_ranges[column] = (start, len(values))
+
+        # Flat CSR layout: rows of choice i are row_order[row_ptr[i]:row_ptr[i + 1]]
+        self.choices = np.array(values, dtype=object)
+        counts = np.concatenate([c for _, c in row_groups]) if row_groups else np.zeros(0, dtype=np.int64)
+        self.row_ptr = np.zeros(len(self.choices) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.row_ptr[1:])
+        self.row_order = np.concatenate([r for r, _ in row_groups]) if row_groups else np.zeros(0, dtype=np.int64)
+
+        logging.info(f"Built fuzzy index with {len(self.choices)} unique values across {len(self.columns)} columns")
+
+        self.ngram_index = NGramIndex(self.choices, max_candidates=max_candidates) if candidate_index else None
+
+    def rows_for(self, choice_id: int) -> np.ndarray:
+        """Row positions holding the given unique value"""
+        return self.row_order[self.row_ptr[choice_id]:self.row_ptr[choice_id + 1]]
+
+    def score(self, query: str, columns: List[str], score_cutoff: int = 0) -> Dict[str, tuple]:
+        """Score query against every unique value of the given columns in one cdist call"""
+        return self.score_many([query], columns, score_cutoff)[0]
+
+    def score_many(self, queries: List[str], columns: List[str], score_cutoff: int = 0) -> List[Dict[str, tuple]]:
+        """Score a batch of queries against the given columns in one cdist call"""
+        ranges = [self.column_ranges[column] for column in columns]
+        if len(columns) == len(self.columns):
+            choice_ids = np.arange(len(self.choices))
+        else:
+            choice_ids = np.sort(np.concatenate([np.arange(start, end) for start, end in ranges]))
+
+        # Without a candidate index every query scores the same choices
+        query_choice_ids = None
+        if self.ngram_index is not None and len(choice_ids) > self.ngram_index.max_candidates:
+            query_ranges = ranges if len(choice_ids) < len(self.choices) else None
+            query_choice_ids = [self.ngram_index.candidates(query, query_ranges) for query in queries]
+            # A query over its posting budget scores every choice
+            if all(candidates is not None for candidates in query_choice_ids):
+                choice_ids = np.unique(np.concatenate(query_choice_ids))
+
+        scores = process.cdist(
+            queries,
+            self.choices[choice_ids],
+            scorer=fuzz.token_sort_ratio,
+            score_cutoff=score_cutoff,
+            dtype=np.float64,
+            workers=-1
+        )
+
+        if query_choice_ids is not None:
+            # Only keep each query's own candidates so results do not depend on the rest of the batch
+            own = np.zeros(scores.shape, dtype=bool)
+            for row, candidates in enumerate(query_choice_ids):
+                if candidates is None:
+                    own[row] = True
+                else:
+                    own[row, np.searchsorted(choice_ids, candidates)] = True
+            scores[~own] = -1
+
+        # choice_ids is sorted, so each column is one contiguous slice of it
+        bounds = [np.searchsorted(choice_ids, [start, end]) for start, end in ranges]
+        return [
+            {column: (choice_ids[lo:hi], query_scores[lo:hi]) for column, (lo, hi) in zip(columns, bounds)}
+            for query_scores in scores
+        ]
+
 
 class FuzzySearcher:
     """Handles fuzzy text matching"""
@@ -228,66 +764,122 @@ class FuzzySearcher:
               query: str,
               columns: Union[str, List[str]] = None,
               limit: int = 10,
-              score_cutoff: int = 60) -> List[Dict]:
+              score_cutoff: int = 60,
+              index: FuzzyIndex = None) -> List[Dict]:
         """Perform fuzzy search across specified columns"""
+        return FuzzySearcher.search_many(df, [query], columns, limit, score_cutoff, index)[0]
+
+    @staticmethod
+    def search_many(df: pd.DataFrame,
+                    queries: List[str],
+                    columns: Union[str, List[str]] = None,
+                    limit: int = 10,
+                    score_cutoff: int = 60,
+                    index: FuzzyIndex = None) -> List[List[Dict]]:
+        """Perform fuzzy search for a batch of queries, one result list per query"""
         try:
-            if not query:
-                return []
+            batch_results = [[] for _ in queries]
+            scored = [i for i, query in enumerate(queries) if query]
+            if not scored:
+                return batch_results
 
             if columns is None:
                 columns = df.columns.tolist()
             elif isinstance(columns, str):
                 columns = [columns]
 
-            results = []
-            perfect_matches = []
+            if index is None or index.df is not df:
+                index = FuzzyIndex(df)
 
+            valid_columns = []
             for column in columns:
                 if column not in df.columns:
                     logging.warning(f"Column {column} not found in DataFrame")
                     continue
+                valid_columns.append(column)
 
-                matches = process.extract(
-                    query,
-                    df[column].unique(),
-                    scorer=fuzz.token_sort_ratio,
-                    limit=limit,
-                    score_cutoff=score_cutoff
-                )
-
-                for match_tuple in matches:
-                    match = match_tuple[0]
-                    score = match_tuple[1]
+            if not valid_columns:
+                return batch_results
 
-                    matching_rows = df[df[column] == match]
-
-                    for _, row in matching_rows.iterrows():
-                        result = {
-                            'score': score,
-                            'matched_column': column,
-                            'matched_value': match,
-                            'row_data': row.to_dict()
-                        }
-
-                        if score == 100:
-                            perfect_matches.append(result)
-                        else:
-                            results.append(result)
-
-            if perfect_matches:
-                return perfect_matches[:limit]
+            column_scores = index.score_many([queries[i] for i in scored], valid_columns, score_cutoff)
+            for i, query_scores in zip(scored, column_scores):
+                batch_results[i] = FuzzySearcher._collect_matches(
+                    df, index, query_scores, limit, score_cutoff
+                )
 
-            results.sort(key=lambda x: x['score'], reverse=True)
-            return results[:limit]
+            return batch_results
 
         except Exception as e:
             logging.error(f"Error in fuzzy search: {str(e)}")
             raise
 
+    @staticmethod
+    def _collect_matches(df: pd.DataFrame,
+                         index: FuzzyIndex,
+                         column_scores: Dict[str, tuple],
+                         limit: int,
+                         score_cutoff: int) -> List[Dict]:
+        """Turn per-column value scores into ranked row matches"""
+        results = []
+        perfect_matches = []
+
+        for column, (choice_ids, scores) in column_scores.items():
+            # Top `limit` values of this column, ties kept in value order like process.extract
+            candidates = np.flatnonzero(scores >= score_cutoff)
+            candidates = candidates[np.argsort(-scores[candidates], kind='stable')][:limit]
+
+            for position in candidates:
+                choice_id = choice_ids[position]
+                score = float(scores[position])
+                match = index.choices[choice_id]
+
+                matching_rows = df.iloc[index.rows_for(choice_id)].to_dict('records')
+
+                for row_data in matching_rows:
+                    result = {
+                        'score': score,
+                        'matched_column': column,
+                        'matched_value': match,
+                        'row_data': row_data
+                    }
+
+                    if score == 100:
+                        perfect_matches.append(result)
+                    else:
+                        results.append(result)
+
+        if perfect_matches:
+            return perfect_matches[:limit]
+
+        results.sort(key=lambda x: x['score'], reverse=True)
+        return results[:limit]
+
 class VectorSearcher:
     """Handles vector similarity search"""
-    def __init__(self, embedding_model):
+    def __init__(self, embedding_model, embedding_cache: EmbeddingCache = None, model_name: str = None):
+        """
+        Args:
+            embedding_model: SentenceTransformer used to encode queries
+            embedding_cache: Optional cache of query embeddings, keyed by model_name
+            model_name: Name the model's embeddings are cached under
+        """
         self.embedding_model = embedding_model
+        self.embedding_cache = embedding_cache
+        self.model_name = model_name or type(embedding_model).__name__
+        self._id_order = None
+        self._sorted_ids = None
+
+    def set_row_ids(self, row_ids: np.ndarray) -> None:
+        """Map FAISS content ids back to DataFrame rows; without it ids are row positions"""
+        self._id_order = np.argsort(row_ids, kind='stable')
+        self._sorted_ids = row_ids[self._id_order]
+
+    def _rows_for(self, label: int) -> np.ndarray:
+        """DataFrame row positions for a FAISS result label"""
+        if self._sorted_ids is None:
+            return np.array([label])
+        lo, hi = np.searchsorted(self._sorted_ids, [label, label + 1])
+        return self._id_order[lo:hi]
 
     def search(self,
               query: str,
@@ -295,23 +887,52 @@ class VectorSearcher:
               df: pd.DataFrame,
               top_k: int = 10) -> List[Dict]:
         """Perform vector similarity search"""
+        return self.search_many([query], index, df, top_k)[0]
+
+    def search_many(self,
+                    queries: List[str],
+                    index: faiss.Index,
+                    df: pd.DataFrame,
+                    top_k: int = 10) -> List[List[Dict]]:
+        """Perform vector similarity search for a batch of queries with one encode and one index search"""
         try:
-            query_vector = self.embedding_model.encode([query])[0].astype('float32').reshape(1, -1)
-            distances, indices = index.search(query_vector, top_k)
-
-            results = []
-            for idx, dist in zip(indices[0], distances[0]):
-                max_distance = 10
-                similarity = max(0, min(100, (1 - dist/max_distance) * 100))
-
-                result = {
-                    'score': round(similarity, 2),
-                    'matched_type': 'vector',
-                    'row_data': df.iloc[idx].to_dict()
-                }
-                results.append(result)
+            if not queries:
+                return []
+
+            if self.embedding_cache is not None:
+                query_vectors = self.embedding_cache.get_or_compute(self.model_name, list(queries), self.embedding_model.encode)
+            else:
+                query_vectors = np.asarray(self.embedding_model.encode(list(queries)), dtype='float32').reshape(len(queries), -1)
+            inner_product = index.metric_type == faiss.METRIC_INNER_PRODUCT
+            if inner_product:
+                faiss.normalize_L2(query_vectors)
+            distances, indices = index.search(query_vectors, top_k)
+
+            batch_results = []
+            for query_indices, query_distances in zip(indices, distances):
+                results = []
+                for idx, dist in zip(query_indices, query_distances):
+                    if idx < 0:
+                        # Approximate indexes pad with -1 when fewer than top_k neighbours are found
+                        continue
+
+                    if inner_product:
+                        similarity = max(0, min(100, float(dist) * 100))
+                    else:
+                        max_distance = 10
+                        similarity = max(0, min(100, (1 - float(dist)/max_distance) * 100))
+
+                    # Rows with identical text share one vector
+                    for row in self._rows_for(idx):
+                        result = {
+                            'score': round(similarity, 2),
+                            'matched_type': 'vector',
+                            'row_data': df.iloc[row].to_dict()
+                        }
+                        results.append(result)
+                batch_results.append(results[:top_k])
 
-            return results
+            return batch_results
 
         except Exception as e:
             logging.error(f"Error in vector search: {str(e)}")
@@ -380,30 +1001,145 @@ Analyze the results and:
 
 Consider both semantic relevance and match scores. If no good match exists, indicate low confidence."""
 
+@dataclass
+class DecisionRules:
+    """Rules for returning clear-cut matches without an LLM call"""
+    # Top fuzzy match must reach this score and lead the runner-up by fuzzy_margin
+    fuzzy_min_score: float = 90
+    fuzzy_margin: float = 15
+    # Same thresholds for vector matches (0-100 cosine scale)
+    vector_min_score: float = 85
+    vector_margin: float = 10
+    # Top fuzzy and top vector result pointing at the same row, with the fuzzy score at least this high
+    agreement_min_score: float = 70
+    # Disabling keeps only the single-exact-match shortcut
+    enabled: bool = True
+
+    def decide_fuzzy(self, fuzzy_results: List[Dict]) -> Union[Dict, None]:
+        """Decision from fuzzy results alone, None if they are not clear-cut"""
+        # A single exact hit is always returned directly
+        perfect_matches = [match for match in fuzzy_results if match['score'] == 100]
+        if len(perfect_matches) == 1:
+            return self._decision(perfect_matches[0], 'fuzzy', 'exact_match',
+                                  'Found exact text match with 100% confidence')
+
+        if self.enabled and self._clear_lead(fuzzy_results, self.fuzzy_min_score, self.fuzzy_margin):
+            return self._decision(fuzzy_results[0], 'fuzzy', 'fuzzy_margin',
+                                  f"Top fuzzy match scores {fuzzy_results[0]['score']:.1f}, "
+                                  f"well ahead of the next candidate")
+        return None
+
+    def decide_combined(self, fuzzy_results: List[Dict], vector_results: List[Dict]) -> Union[Dict, None]:
+        """Decision once vector results are available, None if the case is ambiguous"""
+        if not self.enabled:
+            return None
+
+        if (fuzzy_results and vector_results
+                and fuzzy_results[0]['score'] >= self.agreement_min_score
+                and fuzzy_results[0]['row_data'] == vector_results[0]['row_data']):
+            return self._decision(fuzzy_results[0], 'fuzzy', 'agreement',
+                                  'Fuzzy and vector search agree on the same top row')
+
+        if self._clear_lead(vector_results, self.vector_min_score, self.vector_margin):
+            return self._decision(vector_results[0], 'vector', 'vector_margin',
+                                  f"Top vector match scores {vector_results[0]['score']:.1f}, "
+                                  f"well ahead of the next candidate")
+        return None
+
+    @staticmethod
+    def _clear_lead(results: List[Dict], min_score: float, margin: float) -> bool:
+        """Whether the top result is strong enough and far enough ahead of the runner-up"""
+        if not results or results[0]['score'] < min_score:
+            return False
+        return len(results) == 1 or results[0]['score'] - results[1]['score'] >= margin
+
+    @staticmethod
+    def _decision(best_match: Dict, match_type: str, decision_path: str, explanation: str) -> Dict:
+        return {
+            'best_match': best_match,
+            'match_type': match_type,
+            'confidence': 'high',
+            'explanation': explanation,
+            'decision_path': decision_path
+        }
+
 class FuzzyFirst:
     """Main class that orchestrates the entire search process"""
-    def __init__(self, file_path: str):
+    def __init__(self,
+                 file_path: str,
+                 fuzzy_candidate_index: bool = False,
+                 index_factory: str = 'Flat',
+                 search_params: Dict = None,
+                 mmap_index: bool = True,
+                 decision_rules: DecisionRules = None,
+                 embedding_cache: EmbeddingCache = None):
         self.data_loader = DataLoader(file_path)
-        self.vector_indexer = VectorIndexer()
+        self.vector_indexer = VectorIndexer(index_factory=index_factory, search_params=search_params)
         self.index_manager = IndexManager()
         self.fuzzy_searcher = FuzzySearcher()
-        self.vector_searcher = VectorSearcher(self.vector_indexer.embedding_model)
+        self.embedding_cache = embedding_cache or EmbeddingCache(Path("index_data") / "query_embeddings.sqlite3")
+        self.vector_searcher = VectorSearcher(self.vector_indexer.embedding_model,
+                                              embedding_cache=self.embedding_cache,
+                                              model_name=self.vector_indexer.embedding_model_name)
         self.result_analyzer = ResultAnalyzer()
+        self.decision_rules = decision_rules or DecisionRules()
+        self.decision_counts = Counter()
 
         self.df = self.data_loader.load()
         self.file_stem = Path(file_path).stem
+        self.fuzzy_index = FuzzyIndex(self.df, candidate_index=fuzzy_candidate_index)
+
+        # Try to load existing index, rebuilding when it was built with a different index type
+        self.index, self.embeddings, self.embedding_ids = self.index_manager.load_index(self.file_stem, mmap=mmap_index)
+        self.index_config = self.index_manager.load_index_config(self.file_stem) or {}
+        if self.index is not None and (
+                self.index_config.get('index_factory') != index_factory
+                or self.index_config.get('id_scheme') != VectorIndexer.ID_SCHEME
+                or self.embedding_ids is None):
+            print(f"Existing index does not match requested index type {index_factory}. Rebuilding...")
+            self.index = None
 
-        # Try to load existing index
-        self.index, self.embeddings = self.index_manager.load_index(self.file_stem)
         if self.index is None:
             print("No existing index found. Creating new index...")
             self.vector_indexer.create_index(self.df)
-            self.index = self.vector_indexer.index
-            self.embeddings = self.vector_indexer.embeddings
-            self.index_manager.save_index(self.index, self.embeddings, self.file_stem)
+            self.index_config = {
+                'index_factory': index_factory,
+                'metric': 'inner_product',
+                'id_scheme': VectorIndexer.ID_SCHEME,
+                'search_params': self.vector_indexer.search_params,
+                'recall_report': self.vector_indexer.recall_report
+            }
+            self._save_vector_index()
         else:
+            if search_params is not None:
+                self.index_config['search_params'] = search_params
+            self.vector_indexer.apply_search_params(self.index, self.index_config.get('search_params'))
             print("Successfully loaded existing index and embeddings.")
 
+            # Re-encode only rows whose text changed since the index was saved
+            if self.vector_indexer.needs_update(self.df, self.embedding_ids):
+                if mmap_index:
+                    # Memory-mapped indexes are read-only; update an in-memory copy instead
+                    self.index, self.embeddings, self.embedding_ids = self.index_manager.load_index(
+                        self.file_stem, mmap=False
+                    )
+                    self.vector_indexer.apply_search_params(self.index, self.index_config.get('search_params'))
+                self.vector_indexer.update_index(self.df, self.index, self.embeddings, self.embedding_ids)
+                self._save_vector_index()
+
+        self.vector_searcher.set_row_ids(self.vector_indexer.row_ids)
+
+    def _save_vector_index(self) -> None:
+        """Adopt the indexer's current index and persist it with its embedding cache"""
+        self.index = self.vector_indexer.index
+        self.embeddings = self.vector_indexer.embeddings
+        self.embedding_ids = self.vector_indexer.ids
+        if self.vector_indexer.recall_report is not None:
+            self.index_config['recall_report'] = self.vector_indexer.recall_report
+        self.index_manager.save_index(
+            self.index, self.embeddings, self.file_stem, self.index_config, self.embedding_ids
+        )
+
     def smart_search(self,
                     query: str,
                     columns: Union[str, List[str]] = None,
@@ -411,47 +1147,69 @@ class FuzzyFirst:
                     vector_limit: int = 10,
                     score_cutoff: int = 60) -> str:
         """Perform complete search process and return only the best match"""
-        # Get fuzzy search results first
-        fuzzy_results = self.fuzzy_searcher.search(
-            self.df, query, columns, fuzzy_limit, score_cutoff
+        return self.smart_search_many([query], columns, fuzzy_limit, vector_limit, score_cutoff)[0]
+
+    def smart_search_many(self,
+                          queries: List[str],
+                          columns: Union[str, List[str]] = None,
+                          fuzzy_limit: int = 10,
+                          vector_limit: int = 10,
+                          score_cutoff: int = 60) -> List[str]:
+        """Search a batch of queries (e.g. every line item of an email) and return the best match for each"""
+        # Get fuzzy search results for the whole batch first
+        fuzzy_batch = self.fuzzy_searcher.search_many(
+            self.df, queries, columns, fuzzy_limit, score_cutoff, index=self.fuzzy_index
         )
 
-        # Check for 100% fuzzy matches
-        perfect_matches = [match for match in fuzzy_results if match['score'] == 100]
+        responses = [None] * len(queries)
+        pending = []
+        for i, fuzzy_results in enumerate(fuzzy_batch):
+            # Clear-cut fuzzy matches (e.g. a single exact hit) are returned immediately
+            decision = self.decision_rules.decide_fuzzy(fuzzy_results)
+            if decision is not None:
+                responses[i] = self._respond(queries[i], decision)
+            else:
+                pending.append(i)
 
-        # If exactly one perfect match, return it immediately
-        if len(perfect_matches) == 1:
-            return json.dumps({
-                'query': query,
-                'best_match': perfect_matches[0],
-                'match_type': 'fuzzy',
-                'confidence': 'high',
-                'explanation': 'Found exact text match with 100% confidence'
-            }, indent=2)
-
-        # If multiple perfect matches or no perfect match, proceed with full analysis
-        vector_results = self.vector_searcher.search(
-            query, self.index, self.df, vector_limit
+        # Otherwise bring in vector results
+        vector_batch = self.vector_searcher.search_many(
+            [queries[i] for i in pending], self.index, self.df, vector_limit
         )
 
-        # Combine results for analysis
-        search_results = {
-            'fuzzy_matches': fuzzy_results,
-            'vector_matches': vector_results
-        }
+        for i, vector_results in zip(pending, vector_batch):
+            decision = self.decision_rules.decide_combined(fuzzy_batch[i], vector_results)
+            if decision is None:
+                # Only ambiguous cases pay for an LLM analysis
+                search_results = {
+                    'fuzzy_matches': fuzzy_batch[i],
+                    'vector_matches': vector_results
+                }
+                decision = dict(self.result_analyzer.analyze(queries[i], search_results), decision_path='llm')
+            responses[i] = self._respond(queries[i], decision)
 
-        # Analyze results
-        analysis = self.result_analyzer.analyze(query, search_results)
+        return responses
 
-        # Return the best match and analysis
+    def _respond(self, query: str, decision: Dict) -> str:
+        """Serialize a decision and record which path produced it"""
+        self.decision_counts[decision['decision_path']] += 1
         return json.dumps({
             'query': query,
-            'best_match': analysis['best_match'],
-            'match_type': analysis['match_type'],
-            'confidence': analysis['confidence'],
-            'explanation': analysis['explanation']
+            'best_match': decision['best_match'],
+            'match_type': decision['match_type'],
+            'confidence': decision['confidence'],
+            'explanation': decision['explanation'],
+            'decision_path': decision['decision_path']
         }, indent=2)
 
+    def decision_stats(self) -> Dict:
+        """Counts per decision path and the share of queries answered without the LLM"""
+        total = sum(self.decision_counts.values())
+        return {
+            'total': total,
+            'paths': dict(self.decision_counts),
+            'llm_skip_rate': round(1 - self.decision_counts['llm'] / total, 4) if total else 0.0
+        }
+
 # Example usage
 if __name__ == "__main__":
     fuzzy = FuzzyFirst("data/price_list/new_pl_cleaned.xlsx")
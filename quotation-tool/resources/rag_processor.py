@@ -1,18 +1,24 @@
-from typing import Dict, List, Any, Optional, Literal
+from typing import Dict, List, Any, Optional, Literal, Union, Iterator, Tuple, AsyncIterator
 import pandas as pd
-from openai import OpenAI
 import logging
 from datetime import datetime
 import json
 from pathlib import Path
 import numpy as np
-from dataclasses import dataclass, field
+from dataclasses import dataclass
+from functools import cached_property
+import hashlib
+import os
+import shutil
+from resources.embedding_cache import EmbeddingCache
+from resources.embedders import Embedder, OpenAIEmbedder, EMBEDDERS, create_embedder
 import pickle
-from tqdm import tqdm
-import networkx as nx
 import argparse
 import requests  # Add this import for Ollama API calls
 import ollama
+import httpx
+import asyncio
+import re
 
 # Configure logging
 logging.basicConfig(
@@ -20,7 +26,7 @@ logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(),
-        logging.FileHandler('rag_processor.log')
+        logging.FileHandler('rag_processor.log', delay=True)
     ]
 )
 
@@ -34,14 +40,292 @@ class SearchResult:
     rank: int
 
 
-@dataclass
-class GraphNode:
-    """Data class for graph nodes"""
-    id: str
-    data: Dict[str, Any]
-    node_type: str
-    embedding: List[float] = field(default_factory=list)
-    connections: List[str] = field(default_factory=list)
+class HubGraph:
+    """Bipartite row/value-hub graph stored as CSR arrays over embedding-matrix positions.
+
+    Rows sharing a value are linked through one hub node for that value instead of
+    pairwise, so the graph grows linearly with the number of rows.
+    """
+
+    def __init__(self, row_indptr: np.ndarray, row_hubs: np.ndarray, hub_indptr: np.ndarray,
+                 hub_rows: np.ndarray, hub_types: np.ndarray, relationship_types: List[str]):
+        self.num_rows = len(row_indptr) - 1
+        self.num_hubs = len(hub_indptr) - 1
+        self.row_indptr = row_indptr
+        self.row_hubs = row_hubs
+        self.hub_indptr = hub_indptr
+        self.hub_rows = hub_rows
+        # hub_types[h] indexes relationship_types for hub h
+        self.hub_types = hub_types
+        self.relationship_types = relationship_types
+
+    @classmethod
+    def from_memberships(cls, num_rows: int, num_hubs: int, rows: np.ndarray, hubs: np.ndarray,
+                         hub_types: np.ndarray, relationship_types: List[str]) -> 'HubGraph':
+        """Build from parallel (row, hub) membership arrays"""
+        by_row = np.lexsort((hubs, rows))
+        by_hub = np.lexsort((rows, hubs))
+        return cls(cls._indptr(rows[by_row], num_rows), hubs[by_row].astype(np.int32),
+                   cls._indptr(hubs[by_hub], num_hubs), rows[by_hub].astype(np.int32),
+                   hub_types.astype(np.int16), relationship_types)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """CSR arrays for storage; relationship_types are kept separately"""
+        return {'row_indptr': self.row_indptr, 'row_hubs': self.row_hubs, 'hub_indptr': self.hub_indptr,
+                'hub_rows': self.hub_rows, 'hub_types': self.hub_types}
+
+    @staticmethod
+    def _indptr(sorted_keys: np.ndarray, size: int) -> np.ndarray:
+        indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sorted_keys, minlength=size), out=indptr[1:])
+        return indptr
+
+    def hubs_of(self, row: int) -> np.ndarray:
+        """Hubs the row belongs to, in relationship order"""
+        return self.row_hubs[self.row_indptr[row]:self.row_indptr[row + 1]]
+
+    def rows_of(self, hub: int) -> np.ndarray:
+        """Rows linked through the hub"""
+        return self.hub_rows[self.hub_indptr[hub]:self.hub_indptr[hub + 1]]
+
+    def number_of_nodes(self) -> int:
+        return self.num_rows + self.num_hubs
+
+    def number_of_edges(self) -> int:
+        return len(self.hub_rows)
+
+
+class BM25Index:
+    """Okapi BM25 over row text, stored term-major as CSR postings with precomputed weights"""
+
+    TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+    PART_SEPARATOR = re.compile(r"[-./]")
+
+    def __init__(self, terms: np.ndarray, indptr: np.ndarray, postings: np.ndarray,
+                 weights: np.ndarray, num_docs: int):
+        self.terms = terms
+        # postings[indptr[t]:indptr[t + 1]] are the rows holding term t, weighted by weights
+        self.indptr = indptr
+        self.postings = postings
+        self.weights = weights
+        self.num_docs = int(num_docs)
+        self._vocabulary = None
+
+    @classmethod
+    def tokenize(cls, text: str) -> List[str]:
+        """Lowercase word tokens; codes such as "pg-63" also yield "pg", "63" and "pg63" """
+        tokens = []
+        for token in cls.TOKEN_PATTERN.findall(str(text).lower()):
+            tokens.append(token)
+            parts = cls.PART_SEPARATOR.split(token)
+            if len(parts) > 1:
+                tokens.extend(parts)
+                tokens.append("".join(parts))
+        return tokens
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.5, b: float = 0.75) -> 'BM25Index':
+        num_docs = len(texts)
+        vocabulary = {}
+        term_ids, lengths = [], np.zeros(num_docs)
+        for doc, text in enumerate(texts):
+            tokens = cls.tokenize(text)
+            lengths[doc] = len(tokens)
+            term_ids.append([vocabulary.setdefault(token, len(vocabulary)) for token in tokens])
+
+        # One posting per (term, row) with its term frequency, sorted by term then row
+        docs = np.repeat(np.arange(num_docs, dtype=np.int64), lengths.astype(np.int64))
+        terms = np.fromiter((t for ids in term_ids for t in ids), dtype=np.int64, count=len(docs))
+        keys, tf = np.unique(terms * max(num_docs, 1) + docs, return_counts=True)
+        post_terms, post_docs = keys // max(num_docs, 1), keys % max(num_docs, 1)
+
+        doc_freq = np.bincount(post_terms, minlength=len(vocabulary))
+        idf = np.log1p((num_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+        length_norm = k1 * (1 - b + b * lengths[post_docs] / max(lengths.mean() if num_docs else 0, 1))
+        weights = idf[post_terms] * tf * (k1 + 1) / (tf + length_norm)
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(doc_freq, out=indptr[1:])
+        return cls(np.array(list(vocabulary), dtype=str), indptr, post_docs.astype(np.int32),
+                   weights.astype(np.float32), num_docs)
+
+    @property
+    def vocabulary(self) -> Dict[str, int]:
+        if self._vocabulary is None:
+            self._vocabulary = {term: i for i, term in enumerate(self.terms.tolist())}
+        return self._vocabulary
+
+    def scores(self, query: str) -> np.ndarray:
+        """BM25 score of every row for the query"""
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for token in set(self.tokenize(query)):
+            term = self.vocabulary.get(token)
+            if term is not None:
+                start, end = self.indptr[term], self.indptr[term + 1]
+                scores[self.postings[start:end]] += self.weights[start:end]
+        return scores
+
+    def code_matches(self, query: str, max_rows: int) -> np.ndarray:
+        """Rows holding a whole code of the query, such as "pg-63"; codes held by more than
+        max_rows rows are too common to identify a row and are ignored"""
+        rows = []
+        for token in set(self.TOKEN_PATTERN.findall(str(query).lower())):
+            term = self.vocabulary.get(token)
+            if term is not None and self.PART_SEPARATOR.search(token):
+                start, end = self.indptr[term], self.indptr[term + 1]
+                if end - start <= max_rows:
+                    rows.append(self.postings[start:end])
+        return np.unique(np.concatenate(rows)).astype(np.int64) if rows else np.zeros(0, dtype=np.int64)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {'terms': self.terms, 'indptr': self.indptr, 'postings': self.postings,
+                'weights': self.weights, 'num_docs': np.array(self.num_docs)}
+
+
+class RAGIndexStore:
+    """Directory index: JSON manifest, .npy embedding matrix, Parquet rows and npz graph/BM25 arrays.
+
+    Nothing is pickled, so an index directory is safe to share; each component is read on
+    first use and the embedding matrix is memory-mapped.
+    """
+
+    FORMAT_VERSION = 1
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._manifest = None
+
+    @property
+    def manifest(self) -> Dict:
+        if self._manifest is None:
+            with open(self.path / 'manifest.json', 'r') as f:
+                self._manifest = json.load(f)
+        return self._manifest
+
+    def exists(self) -> bool:
+        return (self.path / 'manifest.json').exists()
+
+    # Pickled indexes, and directory indexes written before embedders were recorded, used OpenAI
+    LEGACY_EMBEDDER = {'backend': 'openai', 'model': 'text-embedding-3-small'}
+
+    @property
+    def embedder_config(self) -> Dict[str, str]:
+        """Embedder the stored vectors were built with"""
+        if 'embedder' in self.manifest:
+            return self.manifest['embedder']
+        return dict(self.LEGACY_EMBEDDER, model=self.manifest.get('embedding_model', self.LEGACY_EMBEDDER['model']))
+
+    def is_current(self, source_hash: str, embedder: Dict[str, str] = None) -> bool:
+        """Whether this code can read the index, built from the given source file and embedder"""
+        return (self.manifest.get('format_version') == self.FORMAT_VERSION
+                and self.manifest.get('source_hash') in (None, source_hash)
+                and (embedder is None or self.embedder_config == embedder))
+
+    def save(self,
+             df: pd.DataFrame,
+             embedding_matrix: np.ndarray,
+             schema: Dict,
+             source_hash: Optional[str],
+             embedder: Dict[str, str],
+             graph: 'HubGraph' = None,
+             bm25: BM25Index = None) -> None:
+        """Write every component to a temp directory and swap it in"""
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+
+        np.save(tmp_path / 'embeddings.npy', np.ascontiguousarray(embedding_matrix, dtype=np.float32))
+        self._parquet_safe(df).to_parquet(tmp_path / 'rows.parquet')
+        manifest = {
+            'format_version': self.FORMAT_VERSION,
+            'created_at': datetime.now().isoformat(),
+            'source_hash': source_hash,
+            'embedder': embedder,
+            'embedding_dim': int(embedding_matrix.shape[1]),
+            'num_rows': int(embedding_matrix.shape[0]),
+            'schema': schema
+        }
+        if graph is not None:
+            np.savez(tmp_path / 'graph.npz', **graph.to_arrays())
+            manifest['graph'] = {'relationship_types': graph.relationship_types}
+        if bm25 is not None:
+            np.savez(tmp_path / 'bm25.npz', **bm25.to_arrays())
+            manifest['bm25'] = {'num_terms': len(bm25.terms)}
+        with open(tmp_path / 'manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+        # Readers that already memory-mapped the old embeddings keep a valid mapping
+        old_path = self.path.with_name(self.path.name + '.old')
+        shutil.rmtree(old_path, ignore_errors=True)
+        if self.path.exists():
+            os.replace(self.path, old_path)
+        os.replace(tmp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        self._manifest = manifest
+
+    def save_graph(self, graph: 'HubGraph') -> None:
+        """Add or replace the graph arrays of an existing index"""
+        self.save_arrays('graph', graph.to_arrays(), {'relationship_types': graph.relationship_types})
+
+    def save_bm25(self, bm25: BM25Index) -> None:
+        """Add or replace the BM25 arrays of an existing index"""
+        self.save_arrays('bm25', bm25.to_arrays(), {'num_terms': len(bm25.terms)})
+
+    def save_arrays(self, name: str, arrays: Dict[str, np.ndarray], manifest_entry: Dict) -> None:
+        """Add or replace a named set of arrays, described by manifest[name]"""
+        tmp_arrays = self.path / f'{name}.tmp.npz'
+        np.savez(tmp_arrays, **arrays)
+        os.replace(tmp_arrays, self.path / f'{name}.npz')
+        self.update_manifest({name: manifest_entry})
+
+    def load_arrays(self, name: str) -> Optional[Dict[str, np.ndarray]]:
+        if name not in self.manifest:
+            return None
+        with np.load(self.path / f'{name}.npz') as arrays:
+            return {key: arrays[key] for key in arrays.files}
+
+    def update_manifest(self, entries: Dict) -> None:
+        """Merge entries into the manifest of an existing index"""
+        manifest = dict(self.manifest, **entries)
+        tmp_manifest = self.path / 'manifest.json.tmp'
+        with open(tmp_manifest, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_manifest, self.path / 'manifest.json')
+        self._manifest = manifest
+
+    @staticmethod
+    def _parquet_safe(df: pd.DataFrame) -> pd.DataFrame:
+        """Parquet needs string column names and one type per column; mixed columns are stored as text"""
+        df = df.copy()
+        df.columns = [str(column) for column in df.columns]
+        for column in df.columns[df.dtypes == object]:
+            if pd.api.types.infer_dtype(df[column], skipna=True) not in ('string', 'empty'):
+                df[column] = df[column].map(lambda value: value if pd.isna(value) else str(value))
+        return df
+
+    def load_rows(self) -> pd.DataFrame:
+        return pd.read_parquet(self.path / 'rows.parquet')
+
+    def load_doc_ids(self) -> np.ndarray:
+        """Document ids derived from the stored row index, without reading any row data"""
+        index = pd.read_parquet(self.path / 'rows.parquet', columns=[]).index
+        return np.array([f"doc_{idx}" for idx in index], dtype=object)
+
+    def load_embeddings(self, mmap: bool = True) -> np.ndarray:
+        return np.load(self.path / 'embeddings.npy', mmap_mode='r' if mmap else None)
+
+    def load_bm25(self) -> Optional[BM25Index]:
+        if 'bm25' not in self.manifest:
+            return None
+        with np.load(self.path / 'bm25.npz') as arrays:
+            return BM25Index(**{name: arrays[name] for name in arrays.files})
+
+    def load_graph(self) -> Optional['HubGraph']:
+        if 'graph' not in self.manifest:
+            return None
+        with np.load(self.path / 'graph.npz') as arrays:
+            return HubGraph(**{name: arrays[name] for name in arrays.files},
+                            relationship_types=self.manifest['graph']['relationship_types'])
 
 
 class RAGProcessor:
@@ -51,63 +335,168 @@ class RAGProcessor:
                  model: str = "deepseek-r1:7b",  # Changed to Ollama model name
                  index_dir: str = "rag_indexes",
                  index_file: str = None,
-                 ollama_base_url: str = "http://localhost:11434/"):  # Added Ollama URL
+                 ollama_base_url: str = "http://localhost:11434/",  # Added Ollama URL
+                 embedding_batch_tokens: int = 250_000,
+                 embedding_concurrency: int = 4,
+                 graph_max_fanout: int = 50,
+                 embedding_cache: EmbeddingCache = None,
+                 format_mode: Literal["single", "two_pass"] = "single",
+                 ollama_timeout: float = 120.0,
+                 ollama_concurrency: int = 4,
+                 embedder: Embedder = None,
+                 hybrid: bool = True,
+                 rrf_k: int = 60,
+                 rrf_depth: int = 100,
+                 bm25_min_ratio: float = 0.2):
         """
         Initialize RAG Processor
 
         Args:
-            api_key: OpenAI API key (only needed for embeddings)
+            api_key: OpenAI API key (only needed for OpenAI embeddings)
             rag_type: Type of RAG to use ("normal" or "graph")
             model: Ollama model to use (default is deepseek-r1:7b)
             index_dir: Directory for storing indexes
-            index_file: Specific index file to use
+            index_file: Specific index directory (or legacy .pkl index file) to use
             ollama_base_url: Base URL for Ollama API
+            embedding_batch_tokens: Approximate token budget of one OpenAI embeddings request
+            embedding_concurrency: Maximum OpenAI embeddings requests in flight while indexing
+            graph_max_fanout: Maximum rows expanded from one value hub per graph query
+            embedding_cache: Cache for query embeddings; defaults to a SQLite store in index_dir
+            format_mode: "single" picks the best match in one structured LLM call,
+                "two_pass" keeps the original list-then-refine pair of calls
+            ollama_timeout: Seconds to wait for one Ollama response
+            ollama_concurrency: Maximum Ollama requests in flight from aquery
+            embedder: Embedding backend for new indexes, e.g. SentenceTransformerEmbedder() for
+                offline use. Defaults to OpenAI; an existing index keeps the embedder it was built
+                with unless one is passed here, in which case the index is rebuilt to match.
+            hybrid: Fuse BM25 lexical ranks with dense ranks (reciprocal rank fusion), so exact
+                product codes rank well alongside descriptive queries
+            rrf_k: Reciprocal rank fusion constant; larger values flatten the rank weights
+            rrf_depth: Candidates taken from each ranking before fusion
+            bm25_min_ratio: Lexical candidates need at least this fraction of the best BM25 score,
+                so rows sharing only a common token such as the "pg" of "pg-63" are not fused
         """
         self.logger = logging.getLogger(__name__)
         self.logger.info(f"Initializing {rag_type} RAG Processor with {model}")
 
         self.rag_type = rag_type
         self.model = model
+        self.format_mode = format_mode
+        self.hybrid = hybrid
+        self.rrf_k = rrf_k
+        self.rrf_depth = rrf_depth
+        self.bm25_min_ratio = bm25_min_ratio
         self.ollama_url = ollama_base_url
-        self.client = OpenAI(api_key=api_key)  # Keep OpenAI client for embeddings only
+        self.ollama_timeout = ollama_timeout
+        self.ollama_concurrency = ollama_concurrency
+        # Pooled keep-alive connections to the Ollama server
+        self.ollama_client = ollama.Client(host=ollama_base_url, **self._ollama_http_options())
+        self._async_ollama = None
+        self._openai_options = {'api_key': api_key, 'batch_tokens': embedding_batch_tokens,
+                                'concurrency': embedding_concurrency}
+        self._embedder_explicit = embedder is not None
+        self.embedder = embedder or OpenAIEmbedder(**self._openai_options)
         self.index_dir = Path(index_dir)
         self.index_file = Path(index_file) if index_file else None
         self.index_dir.mkdir(exist_ok=True)
+        self.embedding_cache = embedding_cache or EmbeddingCache(self.index_dir / "query_embeddings.sqlite3")
 
-        self.df = None
-        self.embeddings = {}
+        # df, embedding_matrix, doc_ids and graph are read from this index on first use
+        self._index_store = None
         self.schema_understanding = None
 
         # Graph-specific attributes
         if rag_type == "graph":
-            self.graph = nx.Graph()
-            self.nodes = {}
+            self.graph_max_fanout = graph_max_fanout
 
         # Load index if provided
         if self.index_file and self.index_file.exists():
             self.load_from_index(self.index_file)
 
-    def _get_embedding(self, text: str) -> List[float]:
-        """Get embedding for text using OpenAI's embedding model"""
+    LAZY_COMPONENTS = ('df', 'embedding_matrix', 'doc_ids', 'graph', 'bm25')
+
+    @cached_property
+    def df(self) -> Optional[pd.DataFrame]:
+        return self._index_store.load_rows() if self._index_store else None
+
+    @cached_property
+    def embedding_matrix(self) -> Optional[np.ndarray]:
+        """Pre-normalized float32 row embeddings, row i belongs to doc_ids[i]"""
+        return self._index_store.load_embeddings() if self._index_store else None
+
+    @cached_property
+    def doc_ids(self) -> Optional[np.ndarray]:
+        return self._index_store.load_doc_ids() if self._index_store else None
+
+    @cached_property
+    def graph(self) -> Optional[HubGraph]:
+        return self._index_store.load_graph() if self._index_store else None
+
+    @cached_property
+    def bm25(self) -> Optional[BM25Index]:
+        return self._index_store.load_bm25() if self._index_store else None
+
+    def _get_embedding(self, text: str) -> np.ndarray:
+        """Get embedding for query text from the index's embedder, reusing cached query embeddings"""
         try:
-            response = self.client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response.data[0].embedding
+            return self.embedding_cache.get_or_compute(self.embedder.name, [text], self.embedder.embed_query)[0]
         except Exception as e:
             self.logger.error(f"Error getting embedding: {e}")
             raise
 
-    def _create_row_text(self, row: pd.Series) -> str:
+    def _create_embedder(self, config: Dict[str, str]) -> Embedder:
+        options = self._openai_options if config['backend'] == OpenAIEmbedder.backend else {}
+        return create_embedder(config, **options)
+
+    def _create_row_text(self, row: Union[pd.Series, Dict[str, Any]]) -> str:
         """Create searchable text from row data"""
         return " ".join(f"{col}: {val}" for col, val in row.items())
 
-    def _compute_similarity(self, query_embedding: List[float], doc_embedding: List[float]) -> float:
-        """Compute cosine similarity between embeddings"""
-        return np.dot(query_embedding, doc_embedding) / (
-                np.linalg.norm(query_embedding) * np.linalg.norm(doc_embedding)
-        )
+    def _set_embedding_matrix(self, doc_ids: List[str], embeddings: np.ndarray) -> None:
+        """Store embeddings as one L2-normalized float32 matrix with a parallel doc-id array"""
+        matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        self.embedding_matrix = matrix / np.maximum(norms, 1e-12)
+        self.doc_ids = np.array(doc_ids, dtype=object)
+
+    def _query_scores(self, query: str) -> np.ndarray:
+        """Cosine similarity of the query against every document in one matrix-vector product"""
+        query_embedding = np.asarray(self._get_embedding(query), dtype=np.float32)
+        query_embedding /= max(np.linalg.norm(query_embedding), 1e-12)
+        return self.embedding_matrix @ query_embedding
+
+    def _rank(self, query: str, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Dense scores of every row and the k best row positions, fusing BM25 ranks when hybrid"""
+        scores = self._query_scores(query)
+        if not self.hybrid or self.bm25 is None:
+            return scores, self._top_k(scores, k)
+
+        depth = max(k, self.rrf_depth)
+        dense = self._top_k(scores, depth)
+        lexical_scores = self.bm25.scores(query)
+        lexical = self._top_k(lexical_scores, depth)
+        if len(lexical):
+            lexical = lexical[lexical_scores[lexical] >= max(self.bm25_min_ratio * lexical_scores[lexical[0]], 1e-6)]
+
+        # Reciprocal rank fusion: each ranking contributes 1 / (rrf_k + rank)
+        fused = np.zeros(len(scores))
+        fused[dense] += 1.0 / (self.rrf_k + np.arange(1, len(dense) + 1))
+        fused[lexical] += 1.0 / (self.rrf_k + np.arange(1, len(lexical) + 1))
+        # A product code from the query names its rows; they go ahead of every fused score
+        exact = self.bm25.code_matches(query, depth)
+        fused[exact] += 1.0
+        candidates = np.union1d(np.union1d(dense, lexical), exact)
+        order = np.lexsort((-scores[candidates], -fused[candidates]))
+        return scores, candidates[order[:k]]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+        """Positions of the k highest scores, best first, without sorting every score"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.zeros(0, dtype=np.int64)
+        top = np.argpartition(-scores, k - 1)[:k]
+        return top[np.argsort(-scores[top], kind='stable')]
 
     def _build_graph(self) -> None:
         """Build knowledge graph from data"""
@@ -116,45 +505,42 @@ class RAGProcessor:
 
         try:
             self.logger.info("Building knowledge graph")
-            self.graph.clear()
-
-            # Create nodes for each row
-            for idx, row in self.df.iterrows():
-                node_id = f"doc_{idx}"
-                node_data = row.to_dict()
-
-                # Create graph node
-                node = GraphNode(
-                    id=node_id,
-                    data=node_data,
-                    node_type="product",
-                    embedding=self._get_embedding(self._create_row_text(row))
-                )
-
-                self.nodes[node_id] = node
-                self.graph.add_node(node_id, **node_data)
-
-            # Create edges based on relationships
+            # One hub per shared value of each related column; a column named by several
+            # relationships keeps the last relationship type, as repeated edges used to
+            hub_columns = {}
             if self.schema_understanding and 'relationships' in self.schema_understanding:
                 for rel in self.schema_understanding['relationships']:
-                    from_col = rel['from']
-                    to_col = rel['to']
-
-                    # Create edges between nodes with matching values
-                    values_dict = {}
-                    for node_id, node in self.nodes.items():
-                        from_val = node.data.get(from_col)
-                        if from_val:
-                            if from_val not in values_dict:
-                                values_dict[from_val] = []
-                            values_dict[from_val].append(node_id)
-
-                    # Connect nodes with same values
-                    for nodes in values_dict.values():
-                        for i in range(len(nodes)):
-                            for j in range(i + 1, len(nodes)):
-                                self.graph.add_edge(nodes[i], nodes[j],
-                                                    relationship_type=rel['type'])
+                    if rel['from'] in self.df.columns:
+                        hub_columns[rel['from']] = rel['type']
+            relationship_types = list(dict.fromkeys(hub_columns.values()))
+
+            rows, hubs, hub_types = [], [], []
+            num_hubs = 0
+            for from_col, rel_type in hub_columns.items():
+                values = self.df[from_col]
+                values = values.where(values.notna() & values.map(bool))
+                codes, _ = pd.factorize(values)
+
+                # Values held by a single row link nothing and get no hub
+                counts = np.bincount(codes[codes >= 0])
+                shared = counts >= 2
+                hub_of_code = np.full(len(counts), -1)
+                hub_of_code[shared] = num_hubs + np.arange(shared.sum())
+
+                members = np.flatnonzero(codes >= 0)
+                member_hubs = hub_of_code[codes[members]]
+                linked = member_hubs >= 0
+                rows.append(members[linked])
+                hubs.append(member_hubs[linked])
+                hub_types.append(np.full(shared.sum(), relationship_types.index(rel_type)))
+                num_hubs += int(shared.sum())
+
+            if rows:
+                rows, hubs, hub_types = np.concatenate(rows), np.concatenate(hubs), np.concatenate(hub_types)
+            else:
+                rows = hubs = hub_types = np.zeros(0, dtype=np.int64)
+            self.graph = HubGraph.from_memberships(len(self.doc_ids), num_hubs, rows, hubs, hub_types,
+                                                   relationship_types)
 
             self.logger.info(f"Built graph with {self.graph.number_of_nodes()} nodes "
                              f"and {self.graph.number_of_edges()} edges")
@@ -163,24 +549,76 @@ class RAGProcessor:
             self.logger.error(f"Error building graph: {e}")
             raise
 
+    @staticmethod
+    def _file_hash(file_path: str) -> str:
+        """MD5 of the source file, recorded in the index manifest"""
+        hash_md5 = hashlib.md5()
+        with open(file_path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hash_md5.update(chunk)
+        return hash_md5.hexdigest()
+
+    def _index_path(self, file_path: str) -> Path:
+        if self.index_file:
+            return self.index_file.with_suffix('') if self.index_file.suffix == '.pkl' else self.index_file
+        return self.index_dir / f"{Path(file_path).stem}_index"
+
+    def _use_store(self, store: Optional[RAGIndexStore]) -> None:
+        """Drop loaded components so they are read from store when next used"""
+        self._index_store = store
+        for name in self.LAZY_COMPONENTS:
+            self.__dict__.pop(name, None)
+
+    def _open_store(self, store: RAGIndexStore) -> None:
+        """Point the processor at an index directory; components load when first used"""
+        self._use_store(store)
+        self.schema_understanding = store.manifest['schema']
+
+        # Queries must be embedded by the model that embedded the rows
+        if store.embedder_config != self.embedder.describe():
+            self.logger.info(f"Index was built with {store.embedder_config}, switching embedder")
+            self.embedder = self._create_embedder(store.embedder_config)
+
+        if self.rag_type == "graph" and 'graph' not in store.manifest:
+            self._build_graph()
+            store.save_graph(self.graph)
+
+        if self.hybrid and 'bm25' not in store.manifest:
+            self.bm25 = BM25Index.build([self._create_row_text(row) for row in self.df.to_dict('records')])
+            store.save_bm25(self.bm25)
+
+        self.logger.info(f"Opened index {store.path} with {store.manifest['num_rows']} rows")
+
+    def _migrate_pickle(self, pickle_path: Path, store: RAGIndexStore, source_hash: Optional[str]) -> None:
+        """One-time conversion of a pickled index into the directory format"""
+        self.logger.info(f"Migrating legacy index {pickle_path} to {store.path}")
+        with open(pickle_path, 'rb') as f:
+            saved_data = pickle.load(f)
+
+        if 'embedding_matrix' in saved_data:
+            embedding_matrix = saved_data['embedding_matrix']
+        else:
+            # Older indexes keep one embedding list per document, in row order
+            embedding_matrix = np.array([doc['embedding'] for doc in saved_data['embeddings'].values()],
+                                        dtype=np.float32)
+            embedding_matrix /= np.maximum(np.linalg.norm(embedding_matrix, axis=1, keepdims=True), 1e-12)
+
+        # The graph is rebuilt from the rows when a graph processor opens the index
+        store.save(saved_data['df'], embedding_matrix, saved_data['schema'], source_hash,
+                   RAGIndexStore.LEGACY_EMBEDDER)
+
     def load_from_index(self, index_path: Path) -> None:
-        """Load data from index file"""
+        """Load data from an index directory, migrating a legacy .pkl index first"""
         try:
-            self.logger.info(f"Loading from index file: {index_path}")
-            with open(index_path, 'rb') as f:
-                saved_data = pickle.load(f)
-                self.df = saved_data['df']
-                self.embeddings = saved_data['embeddings']
-                self.schema_understanding = saved_data['schema']
-
-                if self.rag_type == "graph":
-                    if 'graph' in saved_data:
-                        self.graph = saved_data['graph']
-                        self.nodes = saved_data['nodes']
-                    else:
-                        self._build_graph()
-
-            self.logger.info(f"Loaded index with {len(self.embeddings)} embeddings")
+            self.logger.info(f"Loading from index: {index_path}")
+            index_path = Path(index_path)
+            if index_path.suffix == '.pkl':
+                store = RAGIndexStore(index_path.with_suffix(''))
+                if not store.exists():
+                    self._migrate_pickle(index_path, store, source_hash=None)
+            else:
+                store = RAGIndexStore(index_path)
+            self._open_store(store)
         except Exception as e:
             self.logger.error(f"Error loading index file: {e}")
             raise
@@ -189,16 +627,23 @@ class RAGProcessor:
         """Load data and create index"""
         try:
             self.logger.info(f"Loading data from {file_path}")
-
-            # Use specified index file if provided, otherwise generate path
-            index_file = self.index_file if self.index_file else self.index_dir / f"{Path(file_path).stem}_index.pkl"
-
-            # Try to load existing index
-            if not force_rebuild and index_file.exists():
-                self.load_from_index(index_file)
-                return
+            source_hash = self._file_hash(file_path)
+            store = RAGIndexStore(self._index_path(file_path))
+
+            # Try to load existing index, converting a pickled one once
+            if not force_rebuild:
+                pickle_path = store.path.with_suffix('.pkl')
+                if not store.exists() and pickle_path.exists():
+                    self._migrate_pickle(pickle_path, store, source_hash)
+                if store.exists():
+                    embedder = self.embedder.describe() if self._embedder_explicit else None
+                    if store.is_current(source_hash, embedder):
+                        self._open_store(store)
+                        return
+                    self.logger.info(f"Index {store.path} is out of date, rebuilding")
 
             # Load new data
+            self._use_store(None)
             self.df = pd.read_excel(file_path)
             self.logger.info(f"Loaded Excel file with shape: {self.df.shape}")
 
@@ -206,38 +651,22 @@ class RAGProcessor:
             self.logger.info("Analyzing schema")
             self._analyze_schema()
 
-            # Create embeddings
+            # Create embeddings in bulk; the graph index reuses them
             self.logger.info("Creating embeddings for each row")
-            self.embeddings = {}
-
-            for idx, row in tqdm(self.df.iterrows(), total=len(self.df)):
-                row_text = self._create_row_text(row)
-                self.embeddings[f"doc_{idx}"] = {
-                    'embedding': self._get_embedding(row_text),
-                    'text': row_text,
-                    'row_data': row.to_dict()
-                }
+            row_texts = [self._create_row_text(row) for row in self.df.to_dict('records')]
+            row_embeddings = self.embedder.embed(row_texts)
+            self.bm25 = BM25Index.build(row_texts)
+            self._set_embedding_matrix([f"doc_{idx}" for idx in self.df.index], row_embeddings)
 
             # Add graph building for graph RAG
             if self.rag_type == "graph":
                 self._build_graph()
 
             # Save index with graph data if needed
-            save_data = {
-                'df': self.df,
-                'embeddings': self.embeddings,
-                'schema': self.schema_understanding,
-                'created_at': datetime.now().isoformat()
-            }
-
-            if self.rag_type == "graph":
-                save_data.update({
-                    'graph': self.graph,
-                    'nodes': self.nodes
-                })
-
-            with open(index_file, 'wb') as f:
-                pickle.dump(save_data, f)
+            store.save(self.df, self.embedding_matrix, self.schema_understanding, source_hash,
+                       self.embedder.describe(), graph=self.graph if self.rag_type == "graph" else None,
+                       bm25=self.bm25)
+            self._index_store = store
 
             self.logger.info("Data loading and indexing completed")
 
@@ -245,8 +674,12 @@ class RAGProcessor:
             self.logger.error(f"Error loading data: {e}")
             raise
 
-    def _call_ollama(self, messages: List[Dict], json_response: bool = False) -> Dict:
-        """Helper method to call Ollama API"""
+    def _row_data(self, position: int) -> Dict[str, Any]:
+        """Row values as plain Python objects, ready for JSON"""
+        return self.df.iloc[[position]].to_dict('records')[0]
+
+    def _call_ollama(self, messages: List[Dict], json_response: bool = False, schema: Dict = None) -> Dict:
+        """Helper method to call Ollama API; schema constrains the reply to that JSON schema"""
         try:
             # headers = {"Content-Type": "application/json"}
             # data = {
@@ -263,11 +696,11 @@ class RAGProcessor:
             # )
             # response.raise_for_status()
 
-            response = ollama.chat(
+            response = self.ollama_client.chat(
                 model=self.model,
                 messages=messages,
                 stream=False,
-                format="json" if json_response else "text"
+                format=schema or ("json" if json_response else None)
             )
             return response.message.content
             # result = response.json()
@@ -277,6 +710,87 @@ class RAGProcessor:
             self.logger.error(f"Error calling Ollama API: {e}")
             raise
 
+    def _ollama_http_options(self) -> Dict[str, Any]:
+        """httpx settings shared by the sync and async Ollama clients"""
+        return {
+            'timeout': httpx.Timeout(self.ollama_timeout, connect=10.0),
+            'limits': httpx.Limits(max_connections=self.ollama_concurrency,
+                                   max_keepalive_connections=self.ollama_concurrency)
+        }
+
+    async def _async_ollama_client(self) -> Tuple[ollama.AsyncClient, asyncio.Semaphore]:
+        """AsyncClient and concurrency semaphore bound to the running event loop.
+
+        The client's connection pool (an httpx transport we own) can only be closed on the loop
+        it was created on. A guard registered with that loop closes it when the loop shuts down
+        (asyncio.run, loop.shutdown_asyncgens), or earlier through aclose() or a replacement.
+        """
+        loop = asyncio.get_running_loop()
+        if self._async_ollama is None or self._async_ollama[0] is not loop:
+            self._release_async_ollama()
+            options = self._ollama_http_options()
+            transport = httpx.AsyncHTTPTransport(limits=options['limits'])
+            client = ollama.AsyncClient(host=self.ollama_url, timeout=options['timeout'], transport=transport)
+            guard = self._close_on_shutdown(transport)
+            await guard.__anext__()
+            self._async_ollama = (loop, client, asyncio.Semaphore(self.ollama_concurrency), guard)
+        return self._async_ollama[1], self._async_ollama[2]
+
+    @staticmethod
+    async def _close_on_shutdown(transport: httpx.AsyncHTTPTransport) -> AsyncIterator[None]:
+        try:
+            yield
+        finally:
+            await transport.aclose()
+
+    def _release_async_ollama(self) -> None:
+        """Close the pool of the current client on its own loop; a closed loop already closed it"""
+        if self._async_ollama is None:
+            return
+        loop, _, _, guard = self._async_ollama
+        self._async_ollama = None
+        if not loop.is_closed():
+            asyncio.run_coroutine_threadsafe(guard.aclose(), loop)
+
+    async def _acall_ollama(self, messages: List[Dict], json_response: bool = False, schema: Dict = None) -> str:
+        """Async _call_ollama; at most ollama_concurrency requests run at once"""
+        client, semaphore = await self._async_ollama_client()
+        try:
+            async with semaphore:
+                response = await client.chat(
+                    model=self.model,
+                    messages=messages,
+                    stream=False,
+                    format=schema or ("json" if json_response else None)
+                )
+            return response.message.content
+        except Exception as e:
+            self.logger.error(f"Error calling Ollama API: {e}")
+            raise
+
+    async def aclose(self) -> None:
+        """Close the async Ollama connection pool"""
+        if self._async_ollama is not None and self._async_ollama[0] is asyncio.get_running_loop():
+            guard = self._async_ollama[3]
+            self._async_ollama = None
+            await guard.aclose()
+        else:
+            self._release_async_ollama()
+
+    def _stream_ollama(self, messages: List[Dict], schema: Dict = None) -> Iterator[str]:
+        """Stream reply content from Ollama chunk by chunk"""
+        try:
+            for chunk in self.ollama_client.chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                format=schema or "json"
+            ):
+                yield chunk.message.content
+        except Exception as e:
+            self.logger.error(f"Error streaming from Ollama API: {e}")
+            raise
+
     def _analyze_schema(self) -> None:
         """Analyze schema using DeepSeek Chat via Ollama"""
         try:
@@ -346,121 +860,238 @@ class RAGProcessor:
             self.logger.error(f"Error analyzing schema: {e}")
             raise
 
-    def query(self, query: str, top_k: int = 6) -> List[Dict]:
+    def query(self, query: str, top_k: int = 6) -> Dict:
         """Process query using either normal or graph RAG"""
+        return self._format_results(query, self.search(query, top_k))
+
+    def query_stream(self, query: str, top_k: int = 6) -> Iterator[Tuple[str, Dict]]:
+        """Yield ("best_match", match) as soon as the model has produced it, then ("result", full result)"""
+        results = self.search(query, top_k)
+        if self.format_mode == "two_pass":
+            response = self._format_results(query, results)
+            yield "best_match", response["best_match"]
+            yield "result", response
+            return
+
+        content = ""
+        best_match = None
+        decoder = json.JSONDecoder()
+        for chunk in self._stream_ollama(self._single_pass_messages(query, results), schema=self.RESULT_SCHEMA):
+            content += chunk
+            if best_match is None and "}" in chunk:
+                best_match = self._decode_best_match(decoder, content)
+                if best_match is not None:
+                    yield "best_match", self._attach_row(best_match, results)
+        yield "result", self._single_pass_response(content, results)
+
+    async def aquery(self, query: str, top_k: int = 6) -> Dict:
+        """Async query; many can run concurrently against one Ollama server"""
+        # Retrieval is CPU-bound and the embedding client is synchronous
+        results = await asyncio.to_thread(self.search, query, top_k)
+        try:
+            if self.format_mode == "two_pass":
+                initial_response = await self._acall_ollama(self._two_pass_initial_messages(query, results),
+                                                            json_response=True)
+                final_response = await self._acall_ollama(self._two_pass_refinement_messages(query, initial_response),
+                                                          json_response=True)
+                return final_response if isinstance(final_response, dict) else json.loads(final_response)
+
+            content = await self._acall_ollama(self._single_pass_messages(query, results), schema=self.RESULT_SCHEMA)
+            return self._single_pass_response(content, results)
+        except Exception as e:
+            self.logger.error(f"Error formatting results: {e}")
+            raise
+
+    def search(self, query: str, top_k: int = 6) -> List[SearchResult]:
+        """Retrieve the top matches without LLM formatting"""
         if self.rag_type == "normal":
-            return self._normal_query(query, top_k)
+            return self._normal_search(query, top_k)
         else:
-            return self._graph_query(query, top_k)
+            return self._graph_search(query, top_k)
 
-    def _normal_query(self, query: str, top_k: int = 6) -> List[Dict]:
+    def _normal_search(self, query: str, top_k: int = 6) -> List[SearchResult]:
         """Original query method for normal RAG"""
         try:
             self.logger.info(f"Processing query: {query}")
 
-            # Get query embedding
-            query_embedding = self._get_embedding(query)
-
-            # Calculate similarities
-            similarities = []
-            for doc_id, doc_data in self.embeddings.items():
-                score = self._compute_similarity(query_embedding, doc_data['embedding'])
-                similarities.append((doc_id, score))
-
-            # Sort by similarity
-            similarities.sort(key=lambda x: x[1], reverse=True)
+            # Score every document with one matrix-vector product (plus BM25 when hybrid)
+            scores, top_positions = self._rank(query, top_k)
 
             # Get top k results
             top_results = []
-            for rank, (doc_id, score) in enumerate(similarities[:top_k]):
+            for rank, position in enumerate(top_positions):
+                doc_id = self.doc_ids[position]
                 result = SearchResult(
-                    data=self.embeddings[doc_id]['row_data'],
-                    similarity_score=score,
+                    data=self._row_data(position),
+                    similarity_score=float(scores[position]),
                     embedding_id=doc_id,
                     rank=rank + 1
                 )
                 top_results.append(result)
 
-            # Format results using Ollama
-            response = self._format_results(query, top_results)
-
             self.logger.info(f"Found {len(top_results)} matches")
-            return response
+            return top_results
 
         except Exception as e:
             self.logger.error(f"Error processing query: {e}")
             raise
 
-    def _graph_query(self, query: str, top_k: int = 6) -> List[Dict]:
+    def _graph_search(self, query: str, top_k: int = 6) -> List[SearchResult]:
         """Query using graph-based RAG"""
         try:
             self.logger.info(f"Processing graph query: {query}")
 
-            # Get query embedding
-            query_embedding = self._get_embedding(query)
-
-            # Find initial matches
-            similarities = []
-            for node_id, node in self.nodes.items():
-                score = self._compute_similarity(query_embedding, node.embedding)
-                similarities.append((node_id, score))
-
-            # Sort by similarity
-            similarities.sort(key=lambda x: x[1], reverse=True)
+            # Score every row once; neighbor scores are lookups into the same vector
+            scores, seeds = self._rank(query, top_k)
 
             # Get top matches and their neighbors
             results = []
-            seen_nodes = set()
-
-            for node_id, score in similarities[:top_k]:
-                if node_id not in seen_nodes:
-                    # Add the node
-                    node_data = self.nodes[node_id].data
+            seen = np.zeros(len(scores), dtype=bool)
+
+            for seed in seeds:
+                if len(results) >= top_k:
+                    break
+                if seen[seed]:
+                    continue
+                seen[seed] = True
+
+                # Add the node followed by the best-scoring rows of each of its hubs
+                positions = [seed]
+                for hub in self.graph.hubs_of(seed):
+                    slots = min(self.graph_max_fanout, top_k - len(results) - len(positions))
+                    if slots <= 0:
+                        break
+                    members = self.graph.rows_of(hub)
+                    members = members[~seen[members]]
+                    members = members[self._top_k(scores[members], slots)]
+                    seen[members] = True
+                    positions.extend(members)
+
+                for position in positions:
+                    doc_id = self.doc_ids[position]
                     results.append(SearchResult(
-                        data=node_data,
-                        similarity_score=score,
-                        embedding_id=node_id,
+                        data=self._row_data(position),
+                        similarity_score=float(scores[position]),
+                        embedding_id=doc_id,
                         rank=len(results) + 1
                     ))
-                    seen_nodes.add(node_id)
-
-                    # Add connected nodes
-                    for neighbor in self.graph.neighbors(node_id):
-                        if neighbor not in seen_nodes:
-                            neighbor_node = self.nodes[neighbor]
-                            neighbor_score = self._compute_similarity(
-                                query_embedding, neighbor_node.embedding
-                            )
-                            results.append(SearchResult(
-                                data=neighbor_node.data,
-                                similarity_score=neighbor_score,
-                                embedding_id=neighbor,
-                                rank=len(results) + 1
-                            ))
-                            seen_nodes.add(neighbor)
-
-            # Format results using Ollama
-            response = self._format_results(query, results[:top_k])
 
             self.logger.info(f"Found {len(results)} matches using graph RAG")
-            return response
+            return results[:top_k]
 
         except Exception as e:
             self.logger.error(f"Error processing graph query: {e}")
             raise
 
+    # Structured-output schema for the single-pass call. best_match comes first so it is
+    # generated, and can be streamed, before the alternatives. Matches are referenced by
+    # rank and the row data is attached locally, so the model never re-emits rows.
+    MATCH_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "rank": {"type": "integer"},
+            "confidence": {"type": "string", "enum": ["high", "medium", "low"]},
+            "reason": {"type": "string"}
+        },
+        "required": ["rank", "confidence", "reason"]
+    }
+    RESULT_SCHEMA = {
+        "type": "object",
+        "properties": {
+            "best_match": MATCH_SCHEMA,
+            "alternative_matches": {"type": "array", "items": MATCH_SCHEMA, "maxItems": 2}
+        },
+        "required": ["best_match", "alternative_matches"]
+    }
+
+    @staticmethod
+    def _results_payload(results: List[SearchResult]) -> str:
+        return json.dumps([{
+            'rank': r.rank,
+            'data': r.data,
+            'score': r.similarity_score,
+            'confidence': 'high' if r.similarity_score > 0.8 else 'medium' if r.similarity_score > 0.6 else 'low'
+        } for r in results], indent=2, default=str)
+
     def _format_results(self, query: str, results: List[SearchResult]) -> Dict:
         """Format results using DeepSeek via Ollama"""
+        if self.format_mode == "two_pass":
+            return self._format_results_two_pass(query, results)
+        try:
+            content = self._call_ollama(self._single_pass_messages(query, results), schema=self.RESULT_SCHEMA)
+            return self._single_pass_response(content, results)
+        except Exception as e:
+            self.logger.error(f"Error formatting results: {e}")
+            raise
+
+    def _single_pass_messages(self, query: str, results: List[SearchResult]) -> List[Dict]:
+        prompt = f"""Given this query: "{query}"
+            Top {len(results)} matches (sorted by relevance):
+            {self._results_payload(results)}
+
+            Pick the match that best satisfies the query and up to 2 relevant alternatives.
+            Refer to each match by its rank, and give a confidence (high/medium/low) and the
+            reason it matches.
+            """
+        return [
+            {"role": "system", "content": "You are a data analyst. Return only valid JSON."},
+            {"role": "user", "content": prompt}
+        ]
+
+    def _single_pass_response(self, content: Union[str, Dict], results: List[SearchResult]) -> Dict:
+        """Turn the rank-based model output into the best_match/alternative_matches result"""
+        response = content if isinstance(content, dict) else json.loads(content)
+        return {
+            "best_match": self._attach_row(response["best_match"], results),
+            "alternative_matches": [self._attach_row(match, results)
+                                    for match in response.get("alternative_matches", [])]
+        }
+
+    def _attach_row(self, match: Dict, results: List[SearchResult]) -> Dict:
+        by_rank = {r.rank: r.data for r in results}
+        if match.get("rank") not in by_rank:
+            self.logger.warning(f"Model referred to unknown rank {match.get('rank')}")
+        return {
+            "data": by_rank.get(match.get("rank"), {}),
+            "confidence": match.get("confidence", ""),
+            "reason": match.get("reason", ""),
+            "rank": match.get("rank")
+        }
+
+    @staticmethod
+    def _decode_best_match(decoder: json.JSONDecoder, content: str) -> Optional[Dict]:
+        """The best_match object from a partial JSON response, once it is complete"""
+        key = content.find('"best_match"')
+        if key < 0:
+            return None
+        start = content.find("{", key)
+        if start < 0:
+            return None
+        try:
+            return decoder.raw_decode(content, start)[0]
+        except json.JSONDecodeError:
+            return None
+
+    def _format_results_two_pass(self, query: str, results: List[SearchResult]) -> Dict:
+        """Original formatting: list all relevant matches, then ask again for the best one"""
         try:
             # First get all potential matches
-            initial_prompt = f"""Given this query: "{query}"
+            initial_response = self._call_ollama(self._two_pass_initial_messages(query, results), json_response=True)
+
+            # Second pass to find best match
+            final_response = self._call_ollama(self._two_pass_refinement_messages(query, initial_response),
+                                               json_response=True)
+
+            return final_response if isinstance(final_response, dict) else json.loads(final_response)
+
+        except Exception as e:
+            self.logger.error(f"Error formatting results: {e}")
+            raise
+
+    def _two_pass_initial_messages(self, query: str, results: List[SearchResult]) -> List[Dict]:
+        initial_prompt = f"""Given this query: "{query}"
             Top {len(results)} matches (sorted by relevance):
-            {json.dumps([{
-                'rank': r.rank,
-                'data': r.data,
-                'score': r.similarity_score,
-                'confidence': 'high' if r.similarity_score > 0.8 else 'medium' if r.similarity_score > 0.6 else 'low'
-            } for r in results], indent=2)}
+            {self._results_payload(results)}
 
             Return a JSON with:
             1. Top matches (include all relevant matches)
@@ -468,16 +1099,14 @@ class RAGProcessor:
             3. Reasoning for matches
             4. Any relevant context or patterns noticed
             """
-
-            initial_response = self._call_ollama([
-                {"role": "system", "content": "You are a data analyst. Return only valid JSON."},
-                {"role": "user", "content": initial_prompt}
-            ], json_response=True)
-
-            initial_results = initial_response if isinstance(initial_response, dict) else json.loads(initial_response)
-
-            # Second pass to find best match
-            refinement_prompt = f"""These are some of the possible outcomes:
+        return [
+            {"role": "system", "content": "You are a data analyst. Return only valid JSON."},
+            {"role": "user", "content": initial_prompt}
+        ]
+
+    def _two_pass_refinement_messages(self, query: str, initial_response: Union[str, Dict]) -> List[Dict]:
+        initial_results = initial_response if isinstance(initial_response, dict) else json.loads(initial_response)
+        refinement_prompt = f"""These are some of the possible outcomes:
             {json.dumps(initial_results, indent=2)}
 
             And this is the original requirement/query: "{query}"
@@ -498,17 +1127,10 @@ class RAGProcessor:
                 ]
             }}
             """
-
-            final_response = self._call_ollama([
-                {"role": "system", "content": "You are a data analyst. Return only the JSON object, no other text."},
-                {"role": "user", "content": refinement_prompt}
-            ], json_response=True)
-
-            return final_response if isinstance(final_response, dict) else json.loads(final_response)
-
-        except Exception as e:
-            self.logger.error(f"Error formatting results: {e}")
-            raise
+        return [
+            {"role": "system", "content": "You are a data analyst. Return only the JSON object, no other text."},
+            {"role": "user", "content": refinement_prompt}
+        ]
 
     def save_best_match(self, results: Dict, output_file: str = "best_match_results.json") -> None:
         """
@@ -538,13 +1160,17 @@ if __name__ == "__main__":
     try:
         # Create argument parser
         parser = argparse.ArgumentParser(description='RAG Processor')
-        parser.add_argument('--api-key', type=str, required=True, help='OpenAI API key')
+        parser.add_argument('--api-key', type=str, default=None, help='OpenAI API key (for OpenAI embeddings)')
         parser.add_argument('--rag-type', type=str, choices=['normal', 'graph'],
                             default='normal', help='Type of RAG to use')
         parser.add_argument('--input-file', type=str, required=True,
                             help='Input Excel file to process')
         parser.add_argument('--index-file', type=str, default=None,
                             help='Optional specific index file to use')
+        parser.add_argument('--embedder', type=str, choices=list(EMBEDDERS), default=None,
+                            help='Embedding backend for a new index (default: openai, or the existing index\'s)')
+        parser.add_argument('--embedding-model', type=str, default=None,
+                            help='Model for --embedder, e.g. all-MiniLM-L6-v2')
 
         args = parser.parse_args()
 
@@ -552,7 +1178,11 @@ if __name__ == "__main__":
         processor = RAGProcessor(
             api_key=args.api_key,
             rag_type=args.rag_type,
-            index_file=args.index_file
+            index_file=args.index_file,
+            embedder=create_embedder(
+                {'backend': args.embedder, 'model': args.embedding_model},
+                **({'api_key': args.api_key} if args.embedder == OpenAIEmbedder.backend else {})
+            ) if args.embedder else None
         )
 
         # Load data (will use existing index if available)
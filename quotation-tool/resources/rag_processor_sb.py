@@ -1,200 +1,620 @@
-from typing import Dict, List, Any, Optional, Literal
+from typing import Dict, List, Any, Iterator, Optional, Literal
 import pandas as pd
 from openai import OpenAI
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 from pathlib import Path
 import numpy as np
 from dataclasses import dataclass, field
 import pickle
 from tqdm import tqdm
-import networkx as nx
 import argparse
 import requests  # Add this import for Ollama API calls
 import ollama
+import hashlib
+import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from supabase import Client, create_client
+from resources.embedders import Embedder
+from resources.embedding_storage import decode, encode, halfvec_text
+from resources.rag_processor import RAGIndexStore, SearchResult
+from resources.rag_processor import RAGProcessor as LocalRAGProcessor
 
 
-class RAGProcessor:
+@dataclass
+class GraphNode:
+    """Data class for graph nodes"""
+    id: str
+    data: Dict[str, Any]
+    node_type: str
+    embedding: List[float] = field(default_factory=list)
+    connections: List[str] = field(default_factory=list)
+
+
+class RAGProcessor(LocalRAGProcessor):
+    """RAGProcessor that stores its indexes in Supabase; row text, schema analysis and result
+    formatting are shared with the local processor"""
+
+    # Window before the last sync that is fetched again, covering writes committed after it
+    REPLICA_OVERLAP = timedelta(minutes=5)
+
     def __init__(self,
                  api_key: str = None,
                  rag_type: Literal["normal", "graph"] = "normal",
                  model: str = "deepseek-r1:7b",
                  supabase_url: str = None,  # Add Supabase URL
                  supabase_key: str = None,  # Add Supabase key
-                 ollama_base_url: str = "http://localhost:11434/"):
+                 ollama_base_url: str = "http://localhost:11434/",
+                 embedder: Embedder = None,
+                 upsert_batch_size: int = 500,
+                 upsert_concurrency: int = 4,
+                 load_page_size: int = 1000,
+                 load_concurrency: int = 8,
+                 replica_dir: str = "rag_indexes/supabase",
+                 embedding_storage: Literal["float32", "float16", "int8"] = "float32",
+                 **kwargs):
         """
         Initialize RAG Processor with Supabase
+
+        Args:
+            supabase_key: Service role key; row level security gives no other role access to the RAG tables
+            embedder: Row/query embedder; must produce 1536-dim vectors to fit the embeddings table
+            upsert_batch_size: Rows per ingestion batch, i.e. per documents/embeddings upsert request
+            upsert_concurrency: Ingestion batches processed in parallel
+            load_page_size: Rows per page when loading an index; keep at or below PostgREST's max-rows
+            load_concurrency: Pages fetched in parallel when loading an index
+            replica_dir: Directory for local replicas of loaded indexes, one per index_name;
+                None always loads from Supabase
+            embedding_storage: How new embeddings are stored and transferred. "float32" uses the
+                pgvector column; "float16" stores a halfvec and "int8" int8 codes with a per-vector
+                scale, 1/2 and 1/4 of the float32 size. Both reach loaders as bytea, about 3x / 5x
+                less than float32 JSON text; they need pgvector 0.7 or later for halfvec. Loading an
+                index switches to the format it was ingested with.
+            **kwargs: Further options of the local RAGProcessor, e.g. format_mode or ollama_timeout
         """
-        # ... keep existing init code ...
+        super().__init__(api_key=api_key, rag_type=rag_type, model=model, ollama_base_url=ollama_base_url,
+                         embedder=embedder, **kwargs)
+        self.upsert_batch_size = upsert_batch_size
+        self.upsert_concurrency = upsert_concurrency
+        self.load_page_size = load_page_size
+        self.load_concurrency = load_concurrency
+        self.replica_dir = replica_dir
+        self.embedding_storage = embedding_storage
 
         # Initialize Supabase client
+        # Tables and RPCs come from the RAG store migrations in supabase/migrations
         self.supabase: Client = create_client(supabase_url, supabase_key)
 
-        # Check and create tables if needed
-        self._init_supabase_tables()
-
-    def _init_supabase_tables(self):
-        """Ensure required tables exist in Supabase"""
-        # This is just an example - you should create proper migrations in real code
-        try:
-            self.supabase.table('documents').select('*').limit(1).execute()
-        except Exception as e:
-            self.logger.info("Creating documents table")
-            self.supabase.rpc('create_documents_table', {}).execute()
-
     def load_from_index(self, index_name: str) -> None:
-        """Load data from Supabase"""
+        """Load an index from its local replica, syncing rows changed on the server first"""
         try:
             self.logger.info(f"Loading from Supabase index: {index_name}")
 
-            # Load documents
-            docs_response = self.supabase.table('documents') \
-                .select('*') \
-                .eq('index_name', index_name) \
-                .execute()
-            self.df = pd.DataFrame([doc['content'] for doc in docs_response.data])
-
-            # Load embeddings
-            embeddings_response = self.supabase.table('embeddings') \
-                .select('*') \
-                .eq('index_name', index_name) \
-                .execute()
-            self.embeddings = {e['doc_id']: e for e in embeddings_response.data}
-
-            # Load schema
-            schema_response = self.supabase.table('schemas') \
-                .select('*') \
-                .eq('index_name', index_name) \
-                .execute()
-            self.schema_understanding = schema_response.data[0]['schema'] if schema_response.data else None
-
-            # Load graph data if needed
+            version = self._server_version(index_name)
+            store = RAGIndexStore(self._replica_path(index_name)) if self.replica_dir else None
+            sync = store.manifest.get('replica') if store is not None and store.exists() else None
+
+            if (sync is not None and version is not None
+                    and store.manifest.get('format_version') == RAGIndexStore.FORMAT_VERSION):
+                if sync['version'] == version['version']:
+                    self.logger.info(f"Local replica of {index_name} is current (version {sync['version']})")
+                    self._load_replica(index_name, store)
+                    return
+                # Deletes cannot be applied as a delta, so only a server without new ones is synced
+                if not self._changed_since(version['reset_at'], sync['synced_at']):
+                    self._sync_replica(index_name, store, version, sync)
+                    return
+
+            self._load_documents(index_name)
+            self._load_schema(index_name)
             if self.rag_type == "graph":
-                nodes_response = self.supabase.table('graph_nodes') \
-                    .select('*') \
-                    .eq('index_name', index_name) \
-                    .execute()
-                self.nodes = {n['node_id']: GraphNode(**n) for n in nodes_response.data}
-
-                edges_response = self.supabase.table('graph_edges') \
-                    .select('*') \
-                    .eq('index_name', index_name) \
-                    .execute()
-                self.graph = nx.Graph()
-                for edge in edges_response.data:
-                    self.graph.add_edge(edge['source'], edge['target'])
+                self._load_graph(index_name)
+
+            if store is not None and version is not None:
+                self._save_replica(store, version)
 
         except Exception as e:
             self.logger.error(f"Error loading from Supabase: {e}")
             raise
 
+    def _replica_path(self, index_name: str) -> Path:
+        """Replica directory of an index inside replica_dir, whatever characters its name holds.
+
+        The name is reduced to a readable slug of safe characters, so "/" or ".." cannot leave
+        replica_dir, and suffixed with a hash of the exact name, so distinct names never share one.
+        """
+        slug = re.sub(r'[^A-Za-z0-9_-]+', '_', index_name)[:64]
+        digest = hashlib.sha256(index_name.encode('utf-8')).hexdigest()[:16]
+        return Path(self.replica_dir) / f"{slug}-{digest}"
+
+    def _server_version(self, index_name: str) -> Optional[Dict]:
+        """The index's index_versions row; None for indexes not written since versions were added"""
+        response = self.supabase.table('index_versions') \
+            .select('version, reset_at, graph_updated_at, updated_at') \
+            .eq('index_name', index_name) \
+            .execute()
+        return response.data[0] if response.data else None
+
+    def _changed_since(self, changed_at: Optional[str], synced_at: str) -> bool:
+        """Whether a server change may postdate a sync. Server timestamps are transaction start
+        times, so changes up to REPLICA_OVERLAP before the sync count as later."""
+        return (changed_at is not None and
+                datetime.fromisoformat(changed_at) > datetime.fromisoformat(synced_at) - self.REPLICA_OVERLAP)
+
+    def _load_replica(self, index_name: str, store: RAGIndexStore) -> None:
+        self.df = store.load_rows()
+        self.embedding_matrix = store.load_embeddings()
+        self.doc_ids = [f"{index_name}:{row_idx}" for row_idx in self.df.index]
+        self.schema_understanding = store.manifest['schema']
+        self._use_storage(store.manifest['replica'].get('embedding_storage', 'float32'))
+        if self.rag_type == "graph":
+            arrays = store.load_arrays('node_graph')
+            if arrays is None:
+                self._load_graph(index_name)
+                self._save_graph_replica(store)
+            else:
+                self._set_graph_arrays(arrays)
+
+    def _sync_replica(self, index_name: str, store: RAGIndexStore, version: Dict, sync: Dict) -> None:
+        """Fetch documents and embeddings updated since the last sync and merge them into the replica"""
+        since = (datetime.fromisoformat(sync['synced_at']) - self.REPLICA_OVERLAP).isoformat()
+        contents = {}
+        vectors = {}
+        for page in self._keyset_pages('documents', f'row_idx, content, embeddings({self._selected_columns()})',
+                                       index_name, 'row_idx', updated_since=since):
+            for row in page:
+                contents[row['row_idx']] = row['content']
+                vector = self._decode_embedding(self._embedded_row(row))
+                if vector is not None:
+                    vectors[row['row_idx']] = vector
+        # Embeddings are upserted after their documents, so they are checked separately
+        for page in self._keyset_pages('embeddings', f'doc_id, {self._selected_columns()}', index_name, 'doc_id',
+                                       updated_since=since):
+            for row in page:
+                vectors[int(row['doc_id'].rsplit(':', 1)[1])] = self._decode_embedding(row)
+        self.logger.info(f"Syncing replica of {index_name} from version {sync['version']} to "
+                         f"{version['version']}: {len(contents)} documents, {len(vectors)} embeddings changed")
+
+        rows = store.load_rows()
+        old_matrix = store.load_embeddings()
+        n_rows = max([int(rows.index.max()) + 1 if len(rows) else 0,
+                      *(position + 1 for position in contents),
+                      *(position + 1 for position in vectors)])
+        matrix = np.zeros((n_rows, old_matrix.shape[1]), dtype=np.float32)
+        matrix[rows.index] = old_matrix
+        row_contents = [None] * n_rows
+        for position, content in zip(rows.index, rows.to_dict('records')):
+            row_contents[position] = content
+        embedded = np.zeros(n_rows, dtype=bool)
+        embedded[rows.index] = True
+
+        for position, content in contents.items():
+            row_contents[position] = content
+        for position, vector in vectors.items():
+            matrix[position] = vector
+            embedded[position] = True
+        loaded = embedded & np.array([content is not None for content in row_contents], dtype=bool)
+        self._set_documents(index_name, matrix, row_contents, loaded)
+
+        self._load_schema(index_name)
+        if self.rag_type == "graph":
+            arrays = store.load_arrays('node_graph')
+            if arrays is None or self._changed_since(version['graph_updated_at'], sync['synced_at']):
+                self._load_graph(index_name)
+            else:
+                self._set_graph_arrays(arrays)
+        self._save_replica(store, version)
+
+    def _save_replica(self, store: RAGIndexStore, version: Dict) -> None:
+        store.save(self.df, self.embedding_matrix, self.schema_understanding,
+                   source_hash=None, embedder=self.embedder.describe())
+        if self.rag_type == "graph":
+            self._save_graph_replica(store)
+        # Marked with the server's clock, so client clock skew cannot hide changes
+        store.update_manifest({'replica': {'version': version['version'], 'synced_at': version['updated_at'],
+                                           'embedding_storage': self.embedding_storage}})
+        # Continue on the memory-mapped copy, as when the replica was already current
+        self.embedding_matrix = store.load_embeddings()
+        self.logger.info(f"Saved replica to {store.path} at version {version['version']}")
+
+    def _save_graph_replica(self, store: RAGIndexStore) -> None:
+        # Edges may name nodes without a graph_nodes row; has_node tells them apart
+        nodes = [self.nodes.get(node_id) for node_id in self.node_ids]
+        store.save_arrays('node_graph', {
+            'node_ids': np.array(self.node_ids, dtype=str),
+            'node_types': np.array([node.node_type or '' if node else '' for node in nodes], dtype=str),
+            'node_data': np.array([json.dumps(node.data) if node else '' for node in nodes], dtype=str),
+            'has_node': np.array([node is not None for node in nodes], dtype=bool),
+            'indptr': self.graph_indptr,
+            'indices': self.graph_indices
+        }, {'num_nodes': len(self.node_ids), 'num_edges': int(len(self.graph_indices) // 2)})
+
+    def _set_graph_arrays(self, arrays: Dict[str, np.ndarray]) -> None:
+        self.node_ids = arrays['node_ids'].tolist()
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        self.nodes = {
+            node_id: GraphNode(id=node_id, data=json.loads(data), node_type=node_type)
+            for node_id, node_type, data, has_node in zip(self.node_ids, arrays['node_types'].tolist(),
+                                                          arrays['node_data'].tolist(), arrays['has_node'])
+            if has_node
+        }
+        self.graph_indptr = arrays['indptr']
+        self.graph_indices = arrays['indices']
+
+    def _load_schema(self, index_name: str) -> None:
+        schema_response = self.supabase.table('schemas') \
+            .select('schema') \
+            .eq('index_name', index_name) \
+            .execute()
+        self.schema_understanding = schema_response.data[0]['schema'] if schema_response.data else None
+
+    def _load_documents(self, index_name: str) -> None:
+        """Stream documents and their embeddings into a preallocated float32 embedding matrix"""
+        # row_idx runs from 0, so the last document gives the row count
+        last = self.supabase.table('documents') \
+            .select('row_idx') \
+            .eq('index_name', index_name) \
+            .order('row_idx', desc=True) \
+            .limit(1) \
+            .execute()
+        if not last.data:
+            raise ValueError(f"Index {index_name} has no documents")
+        n_rows = last.data[0]['row_idx'] + 1
+        # Any embedding gives the width and storage format; the last document may have none yet
+        embedded = self._first_embedding(index_name, self._selected_columns())
+        if embedded is None:
+            raise ValueError(f"Index {index_name} has no embeddings")
+        if self._decode_embedding(embedded) is None:
+            # A null vector column in float32 mode means the index was ingested in a compact format
+            embedded = self._first_embedding(index_name, self.COMPACT_COLUMNS)
+        dim = len(self._decode_embedding(embedded))
+        self._use_storage(self._storage_of(embedded))
+        columns = f'row_idx, content, embeddings({self._selected_columns()})'
+
+        matrix = np.zeros((n_rows, dim), dtype=np.float32)
+        contents = [None] * n_rows
+        loaded = np.zeros(n_rows, dtype=bool)
+
+        def load_range(start: int, stop: int) -> None:
+            # Ranges are disjoint, so threads write to separate rows of the shared arrays
+            for page in self._keyset_pages('documents', columns, index_name, 'row_idx', start, stop):
+                for row in page:
+                    vector = self._decode_embedding(self._embedded_row(row))
+                    if vector is None:
+                        continue
+                    position = row['row_idx']
+                    matrix[position] = vector
+                    contents[position] = row['content']
+                    loaded[position] = True
+
+        self._fetch_ranges(load_range, 0, n_rows, desc="Loading documents")
+        self._set_documents(index_name, matrix, contents, loaded)
+
+    def _first_embedding(self, index_name: str, columns: str) -> Optional[Dict]:
+        response = self.supabase.table('embeddings') \
+            .select(columns) \
+            .eq('index_name', index_name) \
+            .limit(1) \
+            .execute()
+        return response.data[0] if response.data else None
+
+    def _set_documents(self, index_name: str, matrix: np.ndarray, contents: List[Dict], loaded: np.ndarray) -> None:
+        """Keep the rows that have both a document and an embedding; df is indexed by row_idx"""
+        positions = np.flatnonzero(loaded)
+        if len(positions) < len(loaded):
+            self.logger.warning(f"{len(loaded) - len(positions)} rows of {index_name} have no document or embedding")
+            matrix = matrix[positions]
+        # Stored vectors are raw model output; scoring takes the dot product with a unit query
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+        self.embedding_matrix = matrix
+        self.df = pd.DataFrame([contents[position] for position in positions], index=positions)
+        self.doc_ids = [f"{index_name}:{position}" for position in positions]
+        self.logger.info(f"Loaded {len(self.df)} documents with {matrix.shape[1]}-dim embeddings")
+
+    def _load_graph(self, index_name: str) -> None:
+        """Load graph nodes and build CSR adjacency arrays from the stored edges"""
+        self.nodes = {}
+        # node_id is text, so nodes are read in one sequential keyset-paginated pass
+        for page in self._keyset_pages('graph_nodes', 'node_id, data, node_type', index_name, 'node_id'):
+            for node in page:
+                self.nodes[node['node_id']] = GraphNode(id=node['node_id'], data=node['data'],
+                                                         node_type=node['node_type'])
+
+        # Edge ordinals run from 0 within the index, so the edges split into full page-sized
+        # ranges fetched concurrently, as documents do by row_idx
+        last = self.supabase.table('graph_edges').select('ordinal').eq('index_name', index_name) \
+            .order('ordinal', desc=True).limit(1).execute().data
+
+        def load_range(start: int, stop: int) -> List[tuple]:
+            return [(edge['source'], edge['target'])
+                    for page in self._keyset_pages('graph_edges', 'ordinal, source, target', index_name, 'ordinal',
+                                                   start, stop)
+                    for edge in page]
+
+        edges = [edge for chunk in self._fetch_ranges(load_range, 0, last[0]['ordinal'] + 1,
+                                                      desc="Loading graph edges")
+                 for edge in chunk] if last else []
+
+        self.node_ids = list(self.nodes)
+        self.node_index = {node_id: i for i, node_id in enumerate(self.node_ids)}
+        for source, target in edges:
+            for node_id in (source, target):
+                if node_id not in self.node_index:
+                    self.node_index[node_id] = len(self.node_ids)
+                    self.node_ids.append(node_id)
+        pairs = np.array([(self.node_index[source], self.node_index[target]) for source, target in edges],
+                         dtype=np.int64).reshape(-1, 2)
+
+        # Undirected like the networkx graph it replaces: each edge is stored in both
+        # directions and duplicates are dropped
+        pairs = np.unique(np.concatenate([pairs, pairs[:, ::-1]]), axis=0)
+        self.graph_indptr = np.zeros(len(self.node_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(pairs[:, 0], minlength=len(self.node_ids)), out=self.graph_indptr[1:])
+        self.graph_indices = pairs[:, 1].astype(np.int32)
+        self.logger.info(f"Loaded graph with {len(self.node_ids)} nodes and {len(pairs) // 2} edges")
+
+    def neighbors(self, node_id: str) -> List[str]:
+        """Node ids adjacent to node_id in the loaded graph"""
+        i = self.node_index[node_id]
+        return [self.node_ids[j] for j in self.graph_indices[self.graph_indptr[i]:self.graph_indptr[i + 1]]]
+
+    def _keyset_pages(self, table: str, columns: str, index_name: str, key: str,
+                      start: Any = None, stop: Any = None, updated_since: str = None) -> Iterator[List[Dict]]:
+        """Pages of rows with start <= key < stop (either bound optional), ordered by key.
+
+        Each page resumes after the last key seen rather than at an offset, so every request is
+        an index range scan and rows are never skipped when PostgREST caps a response below
+        load_page_size.
+        """
+        last = None
+        while True:
+            request = self.supabase.table(table) \
+                .select(columns) \
+                .eq('index_name', index_name)
+            if last is not None:
+                request = request.gt(key, last)
+            elif start is not None:
+                request = request.gte(key, start)
+            if stop is not None:
+                request = request.lt(key, stop)
+            if updated_since is not None:
+                request = request.gt('updated_at', updated_since)
+            page = request.order(key).limit(self.load_page_size).execute().data
+            if not page:
+                return
+            yield page
+            last = page[-1][key]
+            if stop is not None and last >= stop - 1:
+                return
+
+    def _fetch_ranges(self, load_range, start: int, stop: int, desc: str) -> List[Any]:
+        """Run load_range over page-sized slices of [start, stop) on a thread pool, in order"""
+        bounds = [(lo, min(lo + self.load_page_size, stop)) for lo in range(start, stop, self.load_page_size)]
+        with ThreadPoolExecutor(max_workers=self.load_concurrency) as executor:
+            futures = [executor.submit(load_range, lo, hi) for lo, hi in bounds]
+            for _ in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                pass
+            return [future.result() for future in futures]
+
+    # A row holds either the vector text or, through the embedding_bytes computed column, the
+    # binary form of a compact vector. The compact columns only exist where pgvector has halfvec,
+    # so float32 mode selects the vector column alone
+    FLOAT32_COLUMNS = 'embedding'
+    COMPACT_COLUMNS = 'embedding, embedding_bytes, embedding_scale'
+
+    def _selected_columns(self) -> str:
+        return self.FLOAT32_COLUMNS if self.embedding_storage == 'float32' else self.COMPACT_COLUMNS
+
+    @staticmethod
+    def _embedded_row(row: Dict) -> Optional[Dict]:
+        """Embeddings row of a documents row selected with embeddings(...)"""
+        embedded = row.get('embeddings')
+        # PostgREST returns a one-to-one relation as an object, older versions as a list
+        if isinstance(embedded, list):
+            embedded = embedded[0] if embedded else None
+        return embedded or None
+
+    @staticmethod
+    def _decode_embedding(row: Optional[Dict]) -> Optional[np.ndarray]:
+        """float32 vector of an embeddings row, from compact bytes or from pgvector '[0.1,0.2,...]' text"""
+        if not row:
+            return None
+        if row.get('embedding_bytes'):
+            # PostgREST returns bytea as \x-prefixed hex
+            return decode(bytes.fromhex(row['embedding_bytes'][2:]), row.get('embedding_scale'))
+        vector = row.get('embedding')
+        if vector is None:
+            return None
+        if isinstance(vector, str):
+            return np.fromstring(vector.strip('[]'), sep=',', dtype=np.float32)
+        return np.asarray(vector, dtype=np.float32)
+
+    @staticmethod
+    def _storage_of(row: Optional[Dict]) -> str:
+        if not row or not row.get('embedding_bytes'):
+            return 'float32'
+        return 'float16' if row.get('embedding_scale') is None else 'int8'
+
+    def _use_storage(self, storage: str) -> None:
+        """Follow the storage format of a loaded index, so queries search the column it filled"""
+        if storage != self.embedding_storage:
+            self.logger.info(f"Index embeddings are stored as {storage}, not {self.embedding_storage}; using {storage}")
+            self.embedding_storage = storage
+
+    def _embedding_columns(self, embedding: np.ndarray) -> Dict[str, Any]:
+        """embeddings table columns for one vector, stored once in the column of its format. Compact
+        formats set the other columns to null so re-ingesting leaves nothing stale behind; float32
+        sends only the vector column, which every pgvector version has"""
+        if self.embedding_storage == 'float32':
+            return {'embedding': embedding.tolist()}
+        columns = {'embedding': None, 'embedding_half': None, 'embedding_packed': None, 'embedding_scale': None}
+        if self.embedding_storage == 'float16':
+            columns['embedding_half'] = halfvec_text(embedding)
+        else:
+            packed, scale = encode(embedding, 'int8')
+            columns.update(embedding_packed='\\x' + packed.hex(), embedding_scale=scale)
+        return columns
+
     def load_data(self, file_path: str, index_name: str, force_rebuild: bool = False) -> None:
-        """Load data and create index in Supabase"""
+        """Load data and create index in Supabase, resuming an interrupted ingestion"""
         try:
-            # Check if index exists
-            if not force_rebuild:
-                try:
+            source_hash = self._file_hash(file_path)
+
+            if force_rebuild:
+                self._clear_index(index_name)
+            else:
+                # The schema row is written last, so it marks a complete index
+                if self._index_complete(index_name):
                     self.load_from_index(index_name)
                     return
-                except:
-                    pass
 
             # Load new data
             self.df = pd.read_excel(file_path)
 
-            # Store documents in Supabase
-            documents = []
-            for idx, row in self.df.iterrows():
-                doc_id = str(uuid.uuid4())
-                documents.append({
-                    'doc_id': doc_id,
-                    'content': row.to_dict(),
-                    'index_name': index_name,
-                    'created_at': datetime.now().isoformat()
-                })
-
-            # Batch insert documents
-            self.supabase.table('documents').insert(documents).execute()
-
-            # Create and store embeddings
-            embeddings = []
-            for idx, row in tqdm(self.df.iterrows(), total=len(self.df)):
-                doc_id = documents[idx]['doc_id']
-                row_text = self._create_row_text(row)
-                embedding = self._get_embedding(row_text)
-
-                embeddings.append({
-                    'doc_id': doc_id,
-                    'embedding': embedding,
-                    'text': row_text,
-                    'index_name': index_name,
-                    'created_at': datetime.now().isoformat()
-                })
-
-            # Batch insert embeddings
-            self.supabase.table('embeddings').insert(embeddings).execute()
+            # Documents and embeddings are upserted batch by batch under deterministic ids, so a
+            # rerun after a failure only redoes the batches that never completed
+            done = self._completed_batches(index_name, source_hash)
+            batches = [(batch_no, start) for batch_no, start in
+                       enumerate(range(0, len(self.df), self.upsert_batch_size)) if batch_no not in done]
+            self.logger.info(f"Ingesting {len(self.df)} rows into {index_name}: "
+                             f"{len(batches)} batches to do, {len(done)} already done")
+
+            with ThreadPoolExecutor(max_workers=self.upsert_concurrency) as executor:
+                futures = [executor.submit(self._ingest_batch, index_name, source_hash, batch_no, start)
+                           for batch_no, start in batches]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Ingesting batches"):
+                    future.result()
 
             # Store schema
             self._analyze_schema()
-            self.supabase.table('schemas').insert({
+            self.supabase.table('schemas').upsert({
                 'index_name': index_name,
                 'schema': self.schema_understanding,
                 'created_at': datetime.now().isoformat()
-            }).execute()
+            }, on_conflict='index_name').execute()
 
             # Store graph data if needed
             if self.rag_type == "graph":
-                self._build_graph(index_name)
+                self._store_graph(index_name)
 
+            self.supabase.table('ingest_checkpoints').delete().eq('index_name', index_name).execute()
             self.logger.info("Data loading and indexing completed in Supabase")
 
         except Exception as e:
             self.logger.error(f"Error loading data to Supabase: {e}")
             raise
 
-    def _build_graph(self, index_name: str) -> None:
-        """Build and store graph in Supabase"""
+    def _ingest_batch(self, index_name: str, source_hash: str, batch_no: int, start: int) -> None:
+        """Embed and upsert one batch of rows, then checkpoint it"""
+        batch = self.df.iloc[start:start + self.upsert_batch_size]
+        # to_json turns NaN into null and timestamps into ISO strings
+        contents = json.loads(batch.to_json(orient='records', date_format='iso'))
+        row_texts = [self._create_row_text(row) for row in contents]
+        embeddings = self.embedder.embed(row_texts)
+        created_at = datetime.now().isoformat()
+
+        documents = []
+        embedding_rows = []
+        for row_idx, content, row_text, embedding in zip(range(start, start + len(batch)), contents,
+                                                         row_texts, embeddings):
+            doc_id = f"{index_name}:{row_idx}"
+            documents.append({
+                'doc_id': doc_id,
+                'row_idx': row_idx,
+                'content': content,
+                'index_name': index_name,
+                'created_at': created_at
+            })
+            embedding_rows.append({
+                'doc_id': doc_id,
+                **self._embedding_columns(embedding),
+                'text': row_text,
+                'index_name': index_name,
+                'created_at': created_at
+            })
+
+        self.supabase.table('documents').upsert(documents, on_conflict='doc_id').execute()
+        self.supabase.table('embeddings').upsert(embedding_rows, on_conflict='doc_id').execute()
+        self.supabase.table('ingest_checkpoints').upsert({
+            'index_name': index_name,
+            'batch_no': batch_no,
+            'source_hash': source_hash,
+            'batch_size': self.upsert_batch_size,
+            'rows': len(batch)
+        }, on_conflict='index_name,batch_no').execute()
+
+    def _completed_batches(self, index_name: str, source_hash: str) -> set:
+        """Batches already ingested for this exact file and batch size; stale progress is discarded"""
+        response = self.supabase.table('ingest_checkpoints') \
+            .select('batch_no, source_hash, batch_size') \
+            .eq('index_name', index_name) \
+            .execute()
+        if any(row['source_hash'] != source_hash or row['batch_size'] != self.upsert_batch_size
+               for row in response.data):
+            self.logger.info(f"Discarding ingestion progress of {index_name} from a different file or batch size")
+            self._clear_index(index_name)
+            return set()
+        return {row['batch_no'] for row in response.data}
+
+    def _index_complete(self, index_name: str) -> bool:
+        response = self.supabase.table('schemas').select('index_name').eq('index_name', index_name).execute()
+        return bool(response.data)
+
+    def _clear_index(self, index_name: str) -> None:
+        """Remove every stored row of an index; embeddings go with their documents"""
+        for table in ('schemas', 'ingest_checkpoints', 'documents', 'graph_nodes', 'graph_edges'):
+            self.supabase.table(table).delete().eq('index_name', index_name).execute()
+
+    def _store_graph(self, index_name: str) -> None:
+        """Build the row/value-hub graph and store it in Supabase.
+
+        Each hub becomes a graph_nodes row and each row-hub membership a graph_edges row
+        from the document to its hub, uploaded in upsert_batch_size batches.
+        """
         try:
-            # ... keep existing graph building logic ...
-
-            # Store nodes
-            nodes_data = []
-            for node_id, node in self.nodes.items():
-                nodes_data.append({
-                    'node_id': node_id,
-                    'data': node.data,
-                    'node_type': node.node_type,
-                    'embedding': node.embedding,
-                    'index_name': index_name
-                })
-            self.supabase.table('graph_nodes').insert(nodes_data).execute()
-
-            # Store edges
-            edges_data = []
-            for edge in self.graph.edges():
-                edges_data.append({
-                    'source': edge[0],
-                    'target': edge[1],
-                    'index_name': index_name,
-                    'relationship_type': self.graph.edges[edge].get('relationship_type', 'related')
-                })
-            self.supabase.table('graph_edges').insert(edges_data).execute()
+            self.doc_ids = [f"{index_name}:{row_idx}" for row_idx in range(len(self.df))]
+            self._build_graph()
+            graph = self.graph
+            hub_ids = [f"{index_name}:hub:{hub}" for hub in range(graph.num_hubs)]
+            hub_types = [graph.relationship_types[t] for t in graph.hub_types.tolist()]
+            nodes = [{'index_name': index_name, 'node_id': hub_id, 'node_type': 'hub',
+                      'data': {'relationship_type': rel_type}}
+                     for hub_id, rel_type in zip(hub_ids, hub_types)]
+            rows = np.repeat(np.arange(graph.num_rows), np.diff(graph.row_indptr))
+            edges = [{'index_name': index_name, 'ordinal': ordinal, 'source': self.doc_ids[row],
+                      'target': hub_ids[hub], 'relationship_type': hub_types[hub]}
+                     for ordinal, (row, hub) in enumerate(zip(rows.tolist(), graph.row_hubs.tolist()))]
+
+            # graph_edges has no natural key, so the previous graph is removed rather than upserted over
+            for table in ('graph_edges', 'graph_nodes'):
+                self.supabase.table(table).delete().eq('index_name', index_name).execute()
+            self._upload('graph_nodes', nodes, desc="Storing graph nodes")
+            self._upload('graph_edges', edges, desc="Storing graph edges")
 
         except Exception as e:
             self.logger.error(f"Error building graph in Supabase: {e}")
             raise
 
+    def _upload(self, table: str, rows: List[Dict], desc: str) -> None:
+        """Insert rows in upsert_batch_size batches on a thread pool"""
+        batches = [rows[start:start + self.upsert_batch_size] for start in range(0, len(rows), self.upsert_batch_size)]
+        with ThreadPoolExecutor(max_workers=self.upsert_concurrency) as executor:
+            futures = [executor.submit(lambda batch: self.supabase.table(table).insert(batch).execute(), batch)
+                       for batch in batches]
+            for future in tqdm(as_completed(futures), total=len(futures), desc=desc):
+                future.result()
+
     def query(self, query: str, index_name: str, top_k: int = 6) -> List[Dict]:
         """Modified query method to use Supabase vector search"""
         try:
             # Get query embedding
-            query_embedding = self._get_embedding(query)
+            query_embedding = self.embedder.embed_query([query])[0]
 
-            # Perform vector search in Supabase
-            results = self.supabase.rpc('vector_search', {
-                'query_embedding': query_embedding,
+            # Perform vector search in Supabase; halfvec_search covers both compact formats
+            search = 'vector_search' if self.embedding_storage == 'float32' else 'halfvec_search'
+            results = self.supabase.rpc(search, {
+                'query_embedding': query_embedding.tolist(),
                 'index_name': index_name,
                 'match_count': top_k
             }).execute()
@@ -0,0 +1,5 @@
+import logging
+
+# resources.rag_processor calls logging.basicConfig with a FileHandler on import; basicConfig is a
+# no-op once the root logger has a handler, so tests leave no rag_processor.log behind
+logging.getLogger().addHandler(logging.NullHandler())
@@ -0,0 +1,22 @@
+import numpy as np
+
+from resources.embedding_cache import EmbeddingCache
+
+
+def test_empty_texts_give_an_empty_matrix(tmp_path):
+    cache = EmbeddingCache(tmp_path / "cache.sqlite3")
+    calls = []
+
+    def compute(texts):
+        calls.append(texts)
+        return np.ones((len(texts), 4), dtype=np.float32)
+
+    assert cache.get_or_compute("model", [], compute).shape == (0, 0)
+    assert cache.get_or_compute("model", [], compute, dim=4).shape == (0, 4)
+
+    cache.get_or_compute("model", ["pressure gauge"], compute)
+    empty = cache.get_or_compute("model", [], compute)
+    assert empty.shape == (0, 4) and empty.dtype == np.float32
+    # Only the non-empty call reached the model
+    assert calls == [["pressure gauge"]]
+    cache.close()
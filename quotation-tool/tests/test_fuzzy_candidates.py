@@ -0,0 +1,44 @@
+"""The n-gram candidate prefilter must not change the best fuzzy match."""
+import numpy as np
+import pandas as pd
+import pytest
+
+from resources.fuzzy_first import FuzzyIndex
+
+WORDS = ["pressure", "gauge", "brass", "valve", "steel", "pipe", "fitting", "elbow", "flange", "ball",
+         "check", "gate", "copper", "coupling", "reducer", "tee", "union", "nipple", "hose", "clamp"]
+SIZES = ["1/4in", "1/2in", "3/4in", "1in", "2in", "3in", "4in", "dn15", "dn25", "dn50"]
+
+
+@pytest.fixture(scope="module")
+def catalog():
+    rng = np.random.default_rng(0)
+    n_rows = 100_000
+    # Few common words in many combinations, so the whole-word postings are long
+    words = rng.choice(WORDS, size=(n_rows, 3))
+    desc = [" ".join(row) + f" {size}" for row, size in zip(words, rng.choice(SIZES, n_rows))]
+    desc[:3] = ["pressure gauge", "brass valve", "thermowell sensor"]
+    df = pd.DataFrame({
+        "code": [f"PG-{i}" for i in range(n_rows)],
+        "desc": desc,
+        "material": rng.choice(WORDS, n_rows),
+    })
+    return FuzzyIndex(df), FuzzyIndex(df, candidate_index=True)
+
+
+QUERIES = ["pressure gauge", "brass valve", "presure gauge", "steel pipe elbow 2in", "PG-4711",
+           "copper tee union dn25", "ball valve 1/2in", "flange", "thermowel sensor"]
+
+
+def best_score(column_scores):
+    # Below the cutoff cdist reports 0 and the prefilter -1 (not a candidate); both mean no match
+    return max(0, max(scores.max() for _, scores in column_scores.values()))
+
+
+@pytest.mark.parametrize("columns", [["code", "desc", "material"], ["desc"]])
+def test_prefilter_keeps_the_best_match(catalog, columns):
+    full, prefiltered = catalog
+    expected = full.score_many(QUERIES, columns, score_cutoff=60)
+    actual = prefiltered.score_many(QUERIES, columns, score_cutoff=60)
+    for query, expected_scores, actual_scores in zip(QUERIES, expected, actual):
+        assert best_score(actual_scores) == best_score(expected_scores), query
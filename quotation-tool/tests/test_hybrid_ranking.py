@@ -0,0 +1,38 @@
+import numpy as np
+
+from resources.embedders import Embedder
+from resources.rag_processor import BM25Index, RAGProcessor
+
+
+class QueryEmbedder(Embedder):
+    """Embeds every query as the first axis, so a row's dense score is its first component"""
+    backend = 'test'
+
+    def __init__(self):
+        super().__init__('query-axis')
+
+    def embed(self, texts):
+        return np.tile(np.array([1.0, 0.0], dtype=np.float32), (len(texts), 1))
+
+
+def make_processor(tmp_path, texts, dense_scores):
+    processor = RAGProcessor(index_dir=str(tmp_path), embedder=QueryEmbedder())
+    rows = np.stack([dense_scores, np.sqrt(1 - dense_scores ** 2)], axis=1)
+    processor._set_embedding_matrix([f"doc_{i}" for i in range(len(texts))], rows)
+    processor.bm25 = BM25Index.build(texts)
+    return processor
+
+
+def test_exact_code_query_returns_its_row_first(tmp_path):
+    rng = np.random.default_rng(0)
+    texts = [f"PG-{i} {rng.choice(['gland', 'cable', 'nut', 'washer'])} {rng.integers(5, 60)}mm"
+             for i in range(2000)]
+    # Dense embeddings rank code queries poorly: put PG-63 far outside the dense candidates
+    dense_scores = rng.random(2000).astype(np.float32)
+    dense_scores[63] = np.sort(dense_scores)[-500]
+    processor = make_processor(tmp_path, texts, dense_scores)
+
+    scores, top = processor._rank("PG-63", k=6)
+
+    np.testing.assert_allclose(scores, dense_scores, atol=1e-6)
+    assert top[0] == 63
@@ -0,0 +1,144 @@
+/*
+  # RAG vector store
+
+  1. Tables used by quotation-tool/resources/rag_processor_sb.py
+    - documents: one row of a price list per document, keyed by index_name
+    - embeddings: pgvector embedding of each document (text-embedding-3-small, 1536 dims)
+    - schemas: LLM schema analysis per index
+    - graph_nodes / graph_edges: graph RAG data per index
+
+  2. Security
+    - RLS on every table: only the service role (the Python backend, which ingests and
+      queries with the service key) can read or write. Indexes have no owner to scope
+      user reads by, so clients go through the backend
+
+  3. Search
+    - HNSW index (cosine) on embeddings.embedding
+    - btree indexes on index_name for per-index filtering and loading
+    - vector_search(query_embedding, index_name, match_count) returns the top matches
+      with cosine similarity, so nearest-neighbour search runs inside Postgres
+*/
+
+CREATE EXTENSION IF NOT EXISTS vector;
+
+CREATE TABLE IF NOT EXISTS documents (
+  doc_id text PRIMARY KEY,
+  index_name text NOT NULL,
+  content jsonb NOT NULL,
+  created_at timestamptz DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS documents_index_name_idx ON documents (index_name);
+
+CREATE TABLE IF NOT EXISTS embeddings (
+  doc_id text PRIMARY KEY REFERENCES documents (doc_id) ON DELETE CASCADE,
+  index_name text NOT NULL,
+  text text,
+  embedding vector(1536) NOT NULL,
+  created_at timestamptz DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS embeddings_index_name_idx ON embeddings (index_name);
+
+-- Cosine distance to match the normalized OpenAI embeddings
+CREATE INDEX IF NOT EXISTS embeddings_embedding_hnsw_idx
+  ON embeddings
+  USING hnsw (embedding vector_cosine_ops)
+  WITH (m = 16, ef_construction = 64);
+
+CREATE TABLE IF NOT EXISTS schemas (
+  index_name text PRIMARY KEY,
+  schema jsonb,
+  created_at timestamptz DEFAULT now()
+);
+
+CREATE TABLE IF NOT EXISTS graph_nodes (
+  index_name text NOT NULL,
+  node_id text NOT NULL,
+  data jsonb,
+  node_type text,
+  embedding vector(1536),
+  PRIMARY KEY (index_name, node_id)
+);
+
+CREATE TABLE IF NOT EXISTS graph_edges (
+  id bigserial PRIMARY KEY,
+  index_name text NOT NULL,
+  source text NOT NULL,
+  target text NOT NULL,
+  relationship_type text DEFAULT 'related'
+);
+
+CREATE INDEX IF NOT EXISTS graph_edges_index_name_source_idx ON graph_edges (index_name, source);
+
+ALTER TABLE documents ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage documents"
+  ON documents
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+ALTER TABLE embeddings ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage embeddings"
+  ON embeddings
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+ALTER TABLE schemas ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage schemas"
+  ON schemas
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+ALTER TABLE graph_nodes ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage graph_nodes"
+  ON graph_nodes
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+ALTER TABLE graph_edges ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage graph_edges"
+  ON graph_edges
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+-- Top match_count documents of one index by cosine similarity.
+-- The HNSW scan is filtered by index_name after the fact, so ef_search is raised above
+-- the default of 40 to keep enough candidates when several indexes share the table.
+CREATE OR REPLACE FUNCTION vector_search(
+  query_embedding vector(1536),
+  index_name text,
+  match_count int DEFAULT 6
+)
+RETURNS TABLE (
+  doc_id text,
+  content jsonb,
+  similarity float
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 200
+AS $$
+  SELECT
+    e.doc_id,
+    d.content,
+    1 - (e.embedding <=> query_embedding) AS similarity
+  FROM embeddings e
+  JOIN documents d ON d.doc_id = e.doc_id
+  WHERE e.index_name = vector_search.index_name
+  ORDER BY e.embedding <=> query_embedding
+  LIMIT match_count;
+$$;
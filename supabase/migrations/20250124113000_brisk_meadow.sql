@@ -0,0 +1,37 @@
+/*
+  # Resumable RAG ingestion
+
+  1. documents.row_idx
+    - Position of the row in the source price list; documents are upserted under the
+      deterministic id "<index_name>:<row_idx>"
+
+  2. ingest_checkpoints
+    - One row per ingested batch of an index, so an interrupted ingestion resumes
+      where it stopped. Rows are removed once the index is complete.
+
+  3. Security
+    - RLS on ingest_checkpoints: only the service role (the ingestion backend) has access
+*/
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS row_idx integer;
+
+CREATE UNIQUE INDEX IF NOT EXISTS documents_index_name_row_idx_idx ON documents (index_name, row_idx);
+
+CREATE TABLE IF NOT EXISTS ingest_checkpoints (
+  index_name text NOT NULL,
+  batch_no integer NOT NULL,
+  source_hash text NOT NULL,
+  batch_size integer NOT NULL,
+  rows integer NOT NULL,
+  completed_at timestamptz DEFAULT now(),
+  PRIMARY KEY (index_name, batch_no)
+);
+
+ALTER TABLE ingest_checkpoints ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage ingest_checkpoints"
+  ON ingest_checkpoints
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
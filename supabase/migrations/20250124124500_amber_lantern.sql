@@ -0,0 +1,99 @@
+/*
+  # Index versions for local replicas
+
+  1. Change tracking
+    - documents.updated_at / embeddings.updated_at, refreshed on every update by handle_updated_at()
+    - indexes on (index_name, updated_at) so a replica fetches only rows changed since its last sync
+
+  2. New table index_versions
+    - one row per index, bumped once per statement that writes any of its rows
+    - version: compared by replicas to skip a sync when nothing changed
+    - reset_at: last delete of documents or embeddings; replicas cannot apply those as a delta and
+      reload fully
+    - graph_updated_at: last graph change; replicas reload the graph only after one
+
+  3. Security
+    - RLS on index_versions: only the service role can read or write, as for the other RAG tables
+*/
+
+ALTER TABLE documents ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS updated_at timestamptz NOT NULL DEFAULT now();
+
+CREATE INDEX IF NOT EXISTS documents_index_name_updated_at_idx ON documents (index_name, updated_at);
+CREATE INDEX IF NOT EXISTS embeddings_index_name_updated_at_idx ON embeddings (index_name, updated_at);
+
+-- handle_updated_at() comes from the initial schema
+DROP TRIGGER IF EXISTS documents_updated_at ON documents;
+CREATE TRIGGER documents_updated_at
+  BEFORE UPDATE ON documents
+  FOR EACH ROW
+  EXECUTE PROCEDURE handle_updated_at();
+
+DROP TRIGGER IF EXISTS embeddings_updated_at ON embeddings;
+CREATE TRIGGER embeddings_updated_at
+  BEFORE UPDATE ON embeddings
+  FOR EACH ROW
+  EXECUTE PROCEDURE handle_updated_at();
+
+CREATE TABLE IF NOT EXISTS index_versions (
+  index_name text PRIMARY KEY,
+  version bigint NOT NULL DEFAULT 1,
+  reset_at timestamptz,
+  graph_updated_at timestamptz,
+  updated_at timestamptz NOT NULL DEFAULT now()
+);
+
+ALTER TABLE index_versions ENABLE ROW LEVEL SECURITY;
+
+CREATE POLICY "Service role can manage index_versions"
+  ON index_versions
+  FOR ALL
+  TO service_role
+  USING (true)
+  WITH CHECK (true);
+
+-- Statement-level, so a 500-row upsert bumps each index once instead of 500 times
+CREATE OR REPLACE FUNCTION bump_index_version()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO index_versions AS v (index_name, version, reset_at, graph_updated_at, updated_at)
+  SELECT DISTINCT
+    changed_rows.index_name,
+    1,
+    -- Graph and schema deletes are covered by reloading those parts, not every document
+    CASE WHEN TG_OP = 'DELETE' AND TG_TABLE_NAME IN ('documents', 'embeddings') THEN now() END,
+    CASE WHEN TG_TABLE_NAME LIKE 'graph_%' THEN now() END,
+    now()
+  FROM changed_rows
+  ON CONFLICT (index_name) DO UPDATE SET
+    version = v.version + 1,
+    reset_at = COALESCE(EXCLUDED.reset_at, v.reset_at),
+    graph_updated_at = COALESCE(EXCLUDED.graph_updated_at, v.graph_updated_at),
+    updated_at = now();
+  RETURN NULL;
+END;
+$$;
+
+-- Transition tables allow one event per trigger, hence three triggers per table
+DO $$
+DECLARE
+  t text;
+BEGIN
+  FOREACH t IN ARRAY ARRAY['documents', 'embeddings', 'schemas', 'graph_nodes', 'graph_edges'] LOOP
+    EXECUTE format('DROP TRIGGER IF EXISTS %1$s_version_insert ON %1$s', t);
+    EXECUTE format('DROP TRIGGER IF EXISTS %1$s_version_update ON %1$s', t);
+    EXECUTE format('DROP TRIGGER IF EXISTS %1$s_version_delete ON %1$s', t);
+    EXECUTE format('CREATE TRIGGER %1$s_version_insert AFTER INSERT ON %1$s '
+                   'REFERENCING NEW TABLE AS changed_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION bump_index_version()', t);
+    EXECUTE format('CREATE TRIGGER %1$s_version_update AFTER UPDATE ON %1$s '
+                   'REFERENCING NEW TABLE AS changed_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION bump_index_version()', t);
+    EXECUTE format('CREATE TRIGGER %1$s_version_delete AFTER DELETE ON %1$s '
+                   'REFERENCING OLD TABLE AS changed_rows '
+                   'FOR EACH STATEMENT EXECUTE FUNCTION bump_index_version()', t);
+  END LOOP;
+END;
+$$;
@@ -0,0 +1,111 @@
+/*
+  # Compact embedding storage
+
+  Needs pgvector 0.7.0 or later for halfvec. On older versions nothing is created and only
+  embedding_storage="float32" is available.
+
+  1. Changes to embeddings
+    Each row stores its vector once, in the column of its format:
+    - embedding (vector): float32, now optional
+    - embedding_half (halfvec): float16, half the size of vector
+    - embedding_packed / embedding_scale: int8 codes with their per-vector scale, a quarter of vector
+
+  2. Loading
+    - embedding_bytes(embeddings): computed column with the binary form of a compact vector,
+      halfvec_send() output for float16 or the int8 codes, so index loads fetch bytea instead of
+      JSON float text without storing a second copy
+
+  3. Search
+    - int8_halfvec(packed, scale): the int8 codes expanded to a halfvec
+    - HNSW indexes (cosine) on embedding_half and on int8_halfvec(embedding_packed, embedding_scale)
+    - halfvec_search(query_embedding, index_name, match_count): vector_search over both compact formats
+*/
+
+DO $migration$
+DECLARE
+  vector_version int[];
+  vector_schema text;
+BEGIN
+  SELECT string_to_array(extversion, '.')::int[], extnamespace::regnamespace::text
+  INTO vector_version, vector_schema
+  FROM pg_extension
+  WHERE extname = 'vector';
+  IF vector_version < ARRAY[0, 7] THEN
+    RAISE NOTICE 'pgvector % has no halfvec; skipping compact embedding storage', array_to_string(vector_version, '.');
+    RETURN;
+  END IF;
+
+  ALTER TABLE embeddings ALTER COLUMN embedding DROP NOT NULL;
+  ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS embedding_half halfvec(1536);
+  ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS embedding_packed bytea;
+  ALTER TABLE embeddings ADD COLUMN IF NOT EXISTS embedding_scale real;
+
+  ALTER TABLE embeddings DROP CONSTRAINT IF EXISTS embeddings_has_vector;
+  ALTER TABLE embeddings ADD CONSTRAINT embeddings_has_vector
+    CHECK (num_nonnulls(embedding, embedding_half, embedding_packed) = 1
+           AND (embedding_packed IS NULL) = (embedding_scale IS NULL));
+
+  CREATE OR REPLACE FUNCTION int8_halfvec(packed bytea, scale real)
+  RETURNS halfvec
+  LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+  AS $$
+    SELECT array_agg((((get_byte(packed, i) + 128) % 256 - 128) * scale)::real ORDER BY i)::halfvec
+    FROM generate_series(0, length(packed) - 1) AS i
+  $$;
+  -- Index builds resolve names with a restricted search_path (PostgreSQL 17+), so halfvec is
+  -- looked up in the extension's schema
+  EXECUTE format('ALTER FUNCTION int8_halfvec(bytea, real) SET search_path = %I', vector_schema);
+
+  -- PostgREST exposes this as a column of embeddings: select=doc_id,embedding_bytes
+  CREATE OR REPLACE FUNCTION embedding_bytes(embeddings)
+  RETURNS bytea
+  LANGUAGE sql STABLE
+  AS $$
+    SELECT COALESCE(halfvec_send($1.embedding_half), $1.embedding_packed)
+  $$;
+
+  CREATE INDEX IF NOT EXISTS embeddings_embedding_half_hnsw_idx
+    ON embeddings
+    USING hnsw (embedding_half halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+  CREATE INDEX IF NOT EXISTS embeddings_embedding_int8_hnsw_idx
+    ON embeddings
+    USING hnsw ((int8_halfvec(embedding_packed, embedding_scale)::halfvec(1536)) halfvec_cosine_ops)
+    WITH (m = 16, ef_construction = 64);
+
+  -- Each branch orders by its indexed expression, so both are HNSW scans
+  CREATE OR REPLACE FUNCTION halfvec_search(
+    query_embedding halfvec(1536),
+    index_name text,
+    match_count int DEFAULT 6
+  )
+  RETURNS TABLE (
+    doc_id text,
+    content jsonb,
+    similarity float
+  )
+  LANGUAGE sql STABLE
+  SET hnsw.ef_search = 200
+  AS $$
+    SELECT matches.doc_id, d.content, 1 - matches.distance AS similarity
+    FROM (
+      (SELECT e.doc_id, e.embedding_half <=> query_embedding AS distance
+       FROM embeddings e
+       WHERE e.index_name = halfvec_search.index_name AND e.embedding_half IS NOT NULL
+       ORDER BY e.embedding_half <=> query_embedding
+       LIMIT match_count)
+      UNION ALL
+      (SELECT e.doc_id,
+              int8_halfvec(e.embedding_packed, e.embedding_scale)::halfvec(1536) <=> query_embedding AS distance
+       FROM embeddings e
+       WHERE e.index_name = halfvec_search.index_name AND e.embedding_packed IS NOT NULL
+       ORDER BY int8_halfvec(e.embedding_packed, e.embedding_scale)::halfvec(1536) <=> query_embedding
+       LIMIT match_count)
+    ) matches
+    JOIN documents d ON d.doc_id = matches.doc_id
+    ORDER BY matches.distance
+    LIMIT match_count;
+  $$;
+END;
+$migration$;
@@ -0,0 +1,24 @@
+/*
+  # Per-index edge ordinals
+
+  1. Changes to graph_edges
+    - ordinal: position of the edge within its index, 0..n-1, so index loads split edges into
+      page-sized ordinal ranges the way documents are split by row_idx; the shared id sequence
+      leaves gaps wherever other indexes wrote edges
+    - existing edges are numbered in id order
+    - unique index on (index_name, ordinal)
+*/
+
+ALTER TABLE graph_edges ADD COLUMN IF NOT EXISTS ordinal integer;
+
+UPDATE graph_edges e
+SET ordinal = numbered.ordinal
+FROM (
+  SELECT id, row_number() OVER (PARTITION BY index_name ORDER BY id) - 1 AS ordinal
+  FROM graph_edges
+) numbered
+WHERE numbered.id = e.id AND e.ordinal IS NULL;
+
+ALTER TABLE graph_edges ALTER COLUMN ordinal SET NOT NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS graph_edges_index_name_ordinal_idx ON graph_edges (index_name, ordinal);